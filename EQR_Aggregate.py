@@ -0,0 +1,271 @@
+import os
+import math
+import polars as pl
+import EQR_Format
+import EQR_Metrics
+import EQR_Paths
+import EQR_Writer
+
+
+# Mergeable Sketches: one row per group, measure and value with the count, sum and sum of squared deviations (m2) of the values
+# Sketches of chunks or Quarters are combined by concatenating them and merging equal rows, nothing is scanned again
+SKETCH_COLUMNS = ['measure', 'value', 'count', 'sum', 'm2']
+
+# Relative accuracy of the quantile Sketch: None keeps every distinct value (exact medians and quartiles),
+# e.g. 0.01 rounds values to within 1 % (DDSketch buckets) and keeps a few hundred rows per group
+# Set through configure or the EQR_QUANTILE_ACCURACY environment variable, every Quarter of one aggregate has to use the same one
+QUANTILE_ACCURACY = float(os.environ['EQR_QUANTILE_ACCURACY']) if os.environ.get('EQR_QUANTILE_ACCURACY') else None
+
+
+# The environment is updated too so spawned Processes (Batches) sketch the same way
+def configure(quantile_accuracy=None):
+    global QUANTILE_ACCURACY
+    QUANTILE_ACCURACY = quantile_accuracy
+    if quantile_accuracy is None:
+        os.environ.pop('EQR_QUANTILE_ACCURACY', None)
+    else:
+        os.environ['EQR_QUANTILE_ACCURACY'] = str(quantile_accuracy)
+
+
+# Value kept in the Sketch: the value itself, or the middle of its logarithmic bucket
+def sketch_value(value, accuracy):
+    if accuracy is None:
+        return value
+    gamma = (1 + accuracy) / (1 - accuracy)
+    index = (value.abs().log() / math.log(gamma)).ceil()
+    return pl.when(value == 0).then(0.0).otherwise(value.sign() * 2 * pl.lit(gamma).pow(index) / (gamma + 1))
+
+
+# Sketch of a DataFrame grouped by keys, measures: {measure name: column}
+def sketch(df, keys, measures, accuracy=None):
+    accuracy = QUANTILE_ACCURACY if accuracy is None else accuracy
+    frames = []
+    for measure, column in measures.items():
+        x = pl.col('_x')
+        frames.append(df.select(keys + [pl.col(column).cast(pl.Float64).alias('_x')])
+                        .with_columns(pl.lit(measure).alias('measure'), sketch_value(x, accuracy).alias('value'))
+                        .group_by(keys + ['measure', 'value'])
+                        .agg(pl.len().cast(pl.UInt64).alias('count'), x.sum().alias('sum'), ((x - x.mean()) ** 2).sum().alias('m2')))
+    return pl.concat(frames)
+
+
+# Count, sum and m2 of several rows combined (Chan et al.), for a group_by agg
+def merged_moments(mask=None):
+    count, total, m2 = pl.col('count'), pl.col('sum'), pl.col('m2')
+    if mask is not None:
+        count, total, m2 = count.filter(mask), total.filter(mask), m2.filter(mask)
+    mean = total.sum() / count.sum()
+    return count.sum(), total.sum(), m2.sum() + (count * (total / count - mean) ** 2).sum()
+
+
+# Merge the equal rows of a (Lazy)Frame of Sketches, the group keys are every column but the Sketch columns
+def merge_sketch(lf):
+    keys = [column for column in lf.collect_schema().names() if column not in SKETCH_COLUMNS]
+    count, total, m2 = merged_moments()
+    return lf.group_by(keys + ['measure', 'value']).agg(count.alias('count'), total.alias('sum'), m2.alias('m2'))
+
+
+# Merge the Sketches of spill Files into one File with the streaming engine, used by EQR_Pipeline.merge_outputs
+def merge_sketch_files(paths, path, compression=EQR_Writer.COMPRESSION):
+    merge_sketch(pl.scan_parquet(paths)).sink_parquet(path, compression=compression)
+
+
+# Statistics of every group and measure from Sketches: rows (missing values included), count, mean, sd, median, q1 and q3 (R quantile type 7), min and max
+def summarize(lf, keys):
+    lf = merge_sketch(lf.lazy())
+    group = keys + ['measure']
+    known = pl.col('value').is_not_null()
+    lf = lf.sort(group + ['value'], nulls_last=True).with_columns(
+        pl.when(known).then(pl.col('count')).otherwise(0).cum_sum().over(group).alias('_rank'))
+    count, total, m2 = merged_moments(known)
+
+    # Value of rank h (1-based, fractional ranks interpolate between neighbours)
+    def quantile(p):
+        h = (count - 1) * p + 1
+        low = h.floor()
+        x_low = pl.col('value').filter(known & (pl.col('_rank') >= low)).first()
+        x_high = pl.col('value').filter(known & (pl.col('_rank') >= pl.min_horizontal(low + 1, count))).first()
+        return x_low + (h - low) * (x_high - x_low)
+
+    return lf.group_by(group).agg(
+        pl.col('count').sum().alias('rows'),
+        count.alias('count'),
+        (total / count).alias('mean'),
+        pl.when(count > 1).then((m2 / (count - 1)).sqrt()).alias('sd'),
+        quantile(0.5).alias('median'),
+        quantile(0.25).alias('q1'),
+        quantile(0.75).alias('q3'),
+        pl.col('value').filter(known).min().alias('min'),
+        pl.col('value').filter(known).max().alias('max')
+    ).collect()
+
+
+# daily_by_hub of Cluster_Analysis: price and quantity of $/MWH Transactions by begin date and Hub
+DAILY_BY_HUB_KEYS = ['transaction_begin_date', 'hub']
+DAILY_BY_HUB_MEASURES = {'price': 'price', 'quantity': 'transaction_quantity'}
+
+
+# Sketch of a chunk of formatted Transactions, the daily_by_hub Sink of EQR_Pipeline
+def daily_by_hub_sketch(df):
+    df = df.filter((pl.col('rate_units').cast(pl.Utf8) == '$/MWH') & pl.col('price').is_not_null() & pl.col('transaction_quantity').is_not_null())
+    df = df.select(pl.col('transaction_begin_date').dt.date(), pl.col('point_of_delivery_specific_location').str.to_uppercase().alias('hub'),
+                   'price', 'transaction_quantity')
+    return sketch(df, DAILY_BY_HUB_KEYS, DAILY_BY_HUB_MEASURES)
+
+
+# Combine per-Quarter Sketch Files into the daily_by_hub table, same columns as in Cluster_Analysis
+def daily_by_hub(paths):
+    stats = summarize(pl.scan_parquet(paths), DAILY_BY_HUB_KEYS)
+    columns = []
+    for measure in DAILY_BY_HUB_MEASURES:
+        is_measure = pl.col('measure') == measure
+        columns += [
+            pl.col('mean').filter(is_measure).first().alias(f'avg_{measure}'),
+            pl.col('median').filter(is_measure).first().alias(f'median_{measure}'),
+            pl.col('sd').filter(is_measure).first().alias(f'{measure}_sd'),
+            (pl.col('sd') / pl.col('mean')).filter(is_measure).first().alias(f'avg_{measure}_sd_ratio')
+        ]
+    columns.append(pl.col('rows').filter(pl.col('measure') == 'price').first().alias('num_transactions'))
+    return stats.group_by(DAILY_BY_HUB_KEYS).agg(columns).sort(DAILY_BY_HUB_KEYS)
+
+
+# Write the daily_by_hub table of a Product from its per-Quarter Sketches, CSV or Parquet after the extension of output_file_path
+def final_daily_by_hub(product, output_file_path):
+    paths = [path for _, path in EQR_Writer.quarter_files(EQR_Paths.output_dir(product, 'daily_by_hub'))]
+    if len(paths) == 0:
+        print(f'No daily_by_hub Sketches for {product}, run the Pipeline with the daily_by_hub Granularity first.')
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(output_file_path)), exist_ok=True)
+    with EQR_Metrics.stage('aggregate', file=os.path.basename(output_file_path)) as record:
+        df = daily_by_hub(paths)
+        if output_file_path.endswith('.parquet'):
+            df.write_parquet(output_file_path)
+        else:
+            df.write_csv(output_file_path)
+        record['bytes_read'] = sum(os.path.getsize(path) for path in paths)
+        record['rows_out'] = df.height
+        record['bytes_written'] = os.path.getsize(output_file_path)
+
+
+# Precision of the HyperLogLog distinct counts: None counts exactly from the distinct values, e.g. 14 keeps 2^14 registers per group (about 0.8 % error)
+DISTINCT_PRECISION = None
+
+
+# Mergeable Sketch of the distinct values of a column by keys: the distinct values themselves (id),
+# or the highest rank of every HyperLogLog register, merged by taking the highest rank again
+# Register Sketches depend on the Polars hash, Sketches written by another Polars version must not be merged with them
+def distinct_sketch(df, keys, column, precision=None):
+    precision = DISTINCT_PRECISION if precision is None else precision
+    if precision is None:
+        return df.select(keys + [pl.col(column).cast(pl.Utf8).alias('id')]).drop_nulls('id').unique()
+    hash = pl.col(column).cast(pl.Utf8).hash(seed=0)
+    return (df.drop_nulls(column)
+              .select(keys + [(hash // 2 ** (64 - precision)).cast(pl.UInt32).alias('register'),
+                              ((hash % 2 ** (64 - precision)).bitwise_leading_zeros() - precision + 1).cast(pl.UInt8).alias('rank')])
+              .group_by(keys + ['register']).agg(pl.col('rank').max()))
+
+
+# Distinct count of every group from a (Lazy)Frame of distinct Sketches, exact or HyperLogLog estimate with the small range correction
+def distinct_count(lf, keys, precision=None, alias='distinct'):
+    precision = DISTINCT_PRECISION if precision is None else precision
+    lf = lf.lazy()
+    if precision is None:
+        return lf.group_by(keys).agg(pl.col('id').n_unique().alias(alias)).collect()
+    registers = lf.group_by(keys + ['register']).agg(pl.col('rank').max())
+    m = 2 ** precision
+    alpha = 0.7213 / (1 + 1.079 / m)
+    # Registers never set count as rank 0
+    harmonic = (2.0 ** -pl.col('rank').cast(pl.Float64)).sum() + (m - pl.len())
+    zeros = m - pl.len()
+    estimate = alpha * m * m / harmonic
+    return registers.group_by(keys).agg(
+        pl.when((estimate <= 2.5 * m) & (zeros > 0)).then(m * (m / zeros.cast(pl.Float64)).log()).otherwise(estimate).round().cast(pl.UInt64).alias(alias)
+    ).collect()
+
+
+# Summary-statistics Cube of the Study_EQR_Data subgroups: one group_by per dimension, all computed in one pass over a Breakdown output
+CUBE_DIMENSIONS = {
+    'type_of_rate': pl.col('type_of_rate').cast(pl.Utf8).str.to_lowercase(),
+    'term_name': pl.col('term_name').cast(pl.Utf8),
+    'class_name': pl.col('class_name').cast(pl.Utf8),
+    # d, h and m are the same increments as D, H and M
+    'increment_name': pl.when(pl.col('increment_name').cast(pl.Utf8).is_in(['d', 'h', 'm']))
+                        .then(pl.col('increment_name').cast(pl.Utf8).str.to_uppercase())
+                        .otherwise(pl.col('increment_name').cast(pl.Utf8)),
+    'year': pl.col('transaction_begin_date').dt.year().cast(pl.Utf8),
+    'quarter': pl.col('transaction_begin_date').dt.quarter().cast(pl.Utf8),
+    'yq': pl.concat_str([pl.col('transaction_begin_date').dt.year(), pl.lit('-Q'), pl.col('transaction_begin_date').dt.quarter()]),
+    'month': pl.col('transaction_begin_date').dt.month().cast(pl.Utf8)
+}
+
+CUBE_MEASURES = {'transaction_quantity': 'transaction_quantity', 'price': 'price', 'total_transaction_charge': 'total_transaction_charge'}
+CUBE_KEYS = ['dimension', 'level']
+
+# Relative accuracy of the Cube quantiles, the Cube spans every Quarter so exact values would be as large as the data
+CUBE_QUANTILE_ACCURACY = 0.001
+
+# Rows of a Breakdown output sketched at a time, every row is sketched once per dimension
+CUBE_BATCH_SIZE = 250000
+
+
+# Sketches (values, distinct Transactions) of a chunk of Breakdown rows for every dimension of the Cube at once
+def cube_sketch(df, accuracy=CUBE_QUANTILE_ACCURACY, precision=None):
+    if df.schema['transaction_begin_date'] == pl.Utf8:
+        df = df.with_columns(pl.col('transaction_begin_date').str.to_datetime(EQR_Format.DATETIME_FORMAT, time_unit='ms'))
+    columns = list(dict.fromkeys(CUBE_MEASURES.values())) + ['transaction_unique_id']
+    stacked = pl.concat([df.select([pl.lit(dimension).alias('dimension'), level.alias('level')] + columns)
+                         for dimension, level in CUBE_DIMENSIONS.items()])
+    return sketch(stacked, CUBE_KEYS, CUBE_MEASURES, accuracy), distinct_sketch(stacked, CUBE_KEYS, 'transaction_unique_id', precision)
+
+
+# Sketch Files of one per-Quarter Breakdown File, next to it as <name>.cube_values_<accuracy>.parquet and <name>.cube_distinct_<precision>.parquet
+# They are reused while newer than the Breakdown File, so adding a Quarter only sketches that Quarter
+def quarter_cube(path, accuracy=CUBE_QUANTILE_ACCURACY, precision=None):
+    precision = DISTINCT_PRECISION if precision is None else precision
+    base = path[:-len('.parquet')]
+    values_path = f'{base}.cube_values_{accuracy or "exact"}.parquet'
+    distinct_path = f'{base}.cube_distinct_{precision or "exact"}.parquet'
+    if all(os.path.exists(sketch_path) and os.path.getmtime(sketch_path) >= os.path.getmtime(path) for sketch_path in [values_path, distinct_path]):
+        return values_path, distinct_path
+    with EQR_Metrics.stage('cube', file=os.path.basename(path)) as record:
+        values, distinct = [], []
+        for df in EQR_Writer.iter_spill(path, CUBE_BATCH_SIZE):
+            values_df, distinct_df = cube_sketch(df, accuracy, precision)
+            values.append(values_df)
+            distinct.append(distinct_df)
+            EQR_Metrics.count(record, 'rows_in', df.height)
+        values_df = merge_sketch(pl.concat(values).lazy()).collect()
+        distinct_df = pl.concat(distinct)
+        distinct_df = distinct_df.unique() if precision is None else distinct_df.group_by(CUBE_KEYS + ['register']).agg(pl.col('rank').max())
+        values_df.write_parquet(values_path)
+        distinct_df.write_parquet(distinct_path)
+        record['rows_out'] = values_df.height + distinct_df.height
+    return values_path, distinct_path
+
+
+# The Cube of every per-Quarter File of a Product and Granularity: per dimension, level and measure the distinct Transactions,
+# rows, count, mean, sd, median, q1, q3, iqr, min and max, written as CSV or Parquet after the extension of output_file_path
+# A report chunk is then a filter, e.g. cube.filter(pl.col('dimension') == 'type_of_rate', pl.col('measure') == 'price')
+def build_cube(product, granularity, output_file_path, accuracy=CUBE_QUANTILE_ACCURACY, precision=None):
+    files = EQR_Writer.quarter_files(EQR_Paths.output_dir(product, granularity))
+    if len(files) == 0:
+        print(f'No {granularity} Files for {product}.')
+        return
+    sketches = [quarter_cube(path, accuracy, precision) for _, path in files]
+    os.makedirs(os.path.dirname(os.path.abspath(output_file_path)), exist_ok=True)
+    with EQR_Metrics.stage('cube', file=os.path.basename(output_file_path)) as record:
+        stats = summarize(pl.scan_parquet([values_path for values_path, _ in sketches]), CUBE_KEYS)
+        distinct = distinct_count(pl.scan_parquet([distinct_path for _, distinct_path in sketches]), CUBE_KEYS, precision, 'distinct_transactions')
+        # Missing levels (e.g. no class_name) are a group too
+        cube = (stats.with_columns(pl.col('level').fill_null('NA').alias('_level'))
+                     .join(distinct.with_columns(pl.col('level').fill_null('NA').alias('_level')).drop('level'), on=['dimension', '_level'], how='left')
+                     .drop('_level')
+                     .with_columns((pl.col('q3') - pl.col('q1')).alias('iqr'))
+                     .sort(['dimension', 'level', 'measure'], nulls_last=True))
+        if output_file_path.endswith('.parquet'):
+            cube.write_parquet(output_file_path)
+        else:
+            cube.write_csv(output_file_path)
+        record['rows_out'] = cube.height
+        record['bytes_written'] = os.path.getsize(output_file_path)
+    return cube
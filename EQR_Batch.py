@@ -0,0 +1,55 @@
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+
+# List every Quarter from first to last (inclusive), e.g. quarters('2023_Q3', '2024_Q1') -> ['2023_Q3', '2023_Q4', '2024_Q1']
+def quarters(first, last):
+    year, quarter = int(first[:4]), int(first[-1])
+    last_year, last_quarter = int(last[:4]), int(last[-1])
+    year_quarters = []
+    while (year, quarter) <= (last_year, last_quarter):
+        year_quarters.append(str(year) + '_Q' + str(quarter))
+        quarter += 1
+        if quarter > 4:
+            year, quarter = year + 1, 1
+    return year_quarters
+
+
+# Number of Quarters that can run at once without going over the memory budget (in GB)
+def batch_processes(memory_budget, memory_per_quarter, max_processes=None):
+    if max_processes is None:
+        max_processes = os.cpu_count()
+    return max(1, min(max_processes, int(memory_budget // memory_per_quarter)))
+
+
+# Runs in its own Process, returns how long the Quarter took
+def run_quarter(main, year_quarter, workers):
+    start = time.perf_counter()
+    main(year_quarter, workers=workers)
+    return time.perf_counter() - start
+
+
+# Run main(year_quarter) for a range of Quarters, several Quarters at a time
+# main must be a module level function such as EQR_Read_Daily.main (or a functools.partial of one) taking workers as a keyword,
+# each Quarter uses its own temporary Directory
+def run_batch(main, first, last, memory_budget=64, memory_per_quarter=8, max_processes=None, workers=1):
+    year_quarters = quarters(first, last)
+    processes = batch_processes(memory_budget, memory_per_quarter, max_processes)
+    print('Processing', len(year_quarters), 'Quarters with', processes, 'Processes.')
+    timings = {}
+    start = time.perf_counter()
+    # Polars is not fork-safe, Quarters are always run in spawned Processes
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(run_quarter, main, year_quarter, workers): year_quarter for year_quarter in year_quarters}
+        for future in concurrent.futures.as_completed(futures):
+            year_quarter = futures[future]
+            try:
+                timings[year_quarter] = future.result()
+                print(f'{year_quarter} complete in {timings[year_quarter]:.1f} s.')
+            except Exception as error:
+                timings[year_quarter] = None
+                print(f'{year_quarter} failed: {error!r}')
+    print(f'Batch complete in {time.perf_counter() - start:.1f} s.')
+    return dict(sorted(timings.items()))
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import shutil
+import polars as pl
+import EQR_Filter
+import EQR_Format
+import EQR_Metrics
+import EQR_Paths
+import EQR_Pipeline
+import EQR_Reader
+import EQR_Synthetic
+import EQR_Writer
+
+
+# Rows of a stage result: a DataFrame, a list of DataFrames or a row count
+def count_rows(result):
+    if isinstance(result, pl.DataFrame):
+        return result.height
+    if isinstance(result, list):
+        return sum(df.height for df in result)
+    return result
+
+
+# Run one stage and record its wall and CPU time, rows in and out, throughput and the peak RSS of the Process so far
+def measure(results, stage, rows_in, function, *args):
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = function(*args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    process_peak, workers_peak = EQR_Metrics.peak_memory()
+    results.append({
+        'stage': stage,
+        'wall_s': round(wall, 3),
+        'cpu_s': round(cpu, 3),
+        'rows_in': rows_in,
+        'rows_out': count_rows(result),
+        'rows_per_s': round(rows_in / wall) if rows_in and wall > 0 else None,
+        'peak_rss_mb': round(process_peak) if process_peak is not None else None,
+        'workers_peak_rss_mb': round(workers_peak) if workers_peak else None
+    })
+    print(f"{stage:<20}{wall:>9.2f} s{results[-1]['rows_per_s'] or 0:>14,} rows/s{results[-1]['peak_rss_mb'] or 0:>8} MB")
+    return result
+
+
+# Run a Granularity Sink chunk by chunk like the Pipeline does, only the row count is kept
+def breakdown_rows(df, granularity, chunk_size):
+    return sum(EQR_Pipeline.SINKS[granularity](pl.DataFrame(chunk, schema=df.schema)).height for chunk in df.iter_slices(chunk_size))
+
+
+# Benchmark the Pipeline on a synthetic Quarter: read (process_zip_file), fix_data_format, each Breakdown, then the whole
+# single-pass Pipeline for energy and ancillary. Runs anywhere, no FERC Data needed. Stage results can be saved as JSON lines.
+# Mix arguments (hubs, products, peaking, long_term_share) go to EQR_Synthetic.make_quarter
+# Without directory the run gets a scratch directory under the temp root, removed afterwards unless keep
+# A directory of the caller is never removed, only the data, output and temp directories the run creates in it
+def bench(year_quarter='2024_Q1', companies=50, rows_per_company=10000, seed=0, workers=1, chunk_size=10000,
+          directory=None, json_path=None, keep=False, **mix):
+    scratch_dir = directory if directory is not None else EQR_Paths.scratch_dir('bench')
+    created = [scratch_dir] if directory is None else [os.path.join(directory, name) for name in ['data', 'output', 'temp']
+                                                       if not os.path.exists(os.path.join(directory, name))]
+    results = []
+    try:
+        start = time.perf_counter()
+        outer_file, total_rows = EQR_Synthetic.make_quarter(os.path.join(scratch_dir, 'data'), year_quarter, companies, rows_per_company, seed, **mix)
+        print(f'Generated {total_rows:,} Transactions of {companies} Companies in {time.perf_counter() - start:.1f} s '
+              f'({os.path.getsize(outer_file) / 2**20:.0f} MB).')
+
+        with pl.StringCache():
+            df_list = measure(results, 'process_zip_file', total_rows, EQR_Reader.process_outer_zip,
+                              outer_file, EQR_Format.DATATYPES, EQR_Filter.filter_energy, workers)
+            df = measure(results, 'concat', count_rows(df_list), pl.concat, df_list)
+            del df_list
+            measure(results, 'fix_data_format', df.height, EQR_Format.fix_data_format, df)
+            for granularity in ['daily', 'hourly', '15min']:
+                measure(results, 'breakdown_' + granularity, df.height, breakdown_rows, df, granularity, chunk_size)
+            del df
+
+            rules = {product: EQR_Filter.PRODUCTS[product] for product in ['energy', 'ancillary']}
+            outputs = {product: {granularity: os.path.join(scratch_dir, 'output', f'{product}_{granularity}.parquet') for granularity in EQR_Pipeline.SINKS}
+                       for product in rules}
+            measure(results, 'pipeline', total_rows, EQR_Pipeline.run_products,
+                    outer_file, EQR_Format.DATATYPES, rules, outputs, os.path.join(scratch_dir, 'temp'), workers,
+                    EQR_Writer.COMPRESSION, False, chunk_size)
+    finally:
+        if not keep:
+            for path in created:
+                shutil.rmtree(path, ignore_errors=True)
+
+    if json_path is not None:
+        with open(json_path, 'a') as file:
+            for result in results:
+                file.write(json.dumps(dict(result, year_quarter=year_quarter, companies=companies, rows=total_rows, workers=workers)) + '\n')
+    return results
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,92 @@
+import polars as pl
+import EQR_Calendar
+import EQR_Format
+
+
+# Determine if there is any Discrepencies between increment_peaking_name and Transaction Time
+def peaking_hour_error(increment_peaking_name, start_time):
+    is_peak = EQR_Calendar.peak_flag(start_time)
+    # When breakdown to hourly, we should exclude peak Hours if Transaction is off-peak
+    op_error = (increment_peaking_name == 'OP') & is_peak
+    # When breakdown to hourly, we should exclude off-peak Hours if Transaction is peak
+    p_error = (increment_peaking_name == 'P') & ~is_peak
+    return (op_error | p_error).fill_null(False)
+
+
+def peaking_day_error(increment_peaking_name, start_time):
+    # When breakdown to daily, we should exclude off-peak days if Transaction is peak
+    p_error = (increment_peaking_name == 'P') & ~EQR_Calendar.peak_day_flag(start_time)
+    return p_error.fill_null(False)
+
+
+# every: length of one period as a Polars duration, seconds: the same in seconds,
+# duration_column: number of periods of the Transaction, peaking_error: periods to exclude for peak/off-peak Transactions
+GRANULARITIES = {
+    '15min': {'every': '15m', 'seconds': 900, 'duration_column': 'quarter_hour_duration', 'peaking_error': peaking_hour_error},
+    'hourly': {'every': '1h', 'seconds': 3600, 'duration_column': 'hour_duration', 'peaking_error': peaking_hour_error},
+    'daily': {'every': '1d', 'seconds': 86400, 'duration_column': 'day_duration', 'peaking_error': peaking_day_error}
+}
+
+
+# Breakdown a Transaction into one row per period (15 minutes, hour or day)
+# Periods are walked from transaction_begin_date in steps of one period while before transaction_end_date
+def breakdown(df, granularity):
+    every = GRANULARITIES[granularity]['every']
+    seconds = GRANULARITIES[granularity]['seconds']
+    duration_column = GRANULARITIES[granularity]['duration_column']
+    peaking_error = GRANULARITIES[granularity]['peaking_error']
+
+    df = EQR_Format.fix_data_format(df)
+    output_schema = dict(df.schema)
+    output_schema['transaction_begin_date'] = EQR_Format.DATETIME
+    output_schema['transaction_end_date'] = EQR_Format.DATETIME
+    output_schema[duration_column] = pl.UInt16
+
+    begin = pl.col('transaction_begin_date')
+    end = pl.col('transaction_end_date')
+    # Same exact Datetime (or missing Datetime) stays as one row, Transactions ending before they begin are dropped
+    df = df.with_columns((begin == end).fill_null(True).alias('_single'))
+    df = df.filter(pl.col('_single') | (end > begin))
+
+    # Number of periods walked for each Transaction, then one row per period
+    df = df.with_row_index('_row').with_columns(
+        pl.when(pl.col('_single'))
+        .then(pl.lit(1, dtype=pl.Int64))
+        .otherwise(((end - begin).dt.total_seconds() + seconds - 1) // seconds)
+        .alias('_periods')
+    )
+    df = df.with_columns(pl.int_ranges(0, pl.col('_periods')).alias('_k')).explode('_k')
+
+    current_period = begin.dt.truncate(every) + pl.duration(seconds=pl.col('_k') * seconds)
+    start_time = pl.when(pl.col('_k') == 0).then(begin).otherwise(current_period)
+    end_time = pl.when(current_period == end.dt.truncate(every)).then(end).otherwise(current_period + pl.duration(seconds=seconds - 60))
+    df = df.with_columns([
+        start_time.alias('_start_time'),
+        end_time.alias('_end_time')
+    ])
+    df = df.with_columns(
+        (~pl.col('_single') & peaking_error(pl.col('increment_peaking_name'), pl.col('_start_time'))).alias('_excluded')
+    )
+
+    # Every excluded period shrinks the Duration used to prorate the periods that come after it
+    total_duration = (end - begin).dt.total_seconds().cast(pl.Float64)
+    excluded_before = pl.col('_excluded').cast(pl.Int64).cum_sum().over('_row') - pl.col('_excluded').cast(pl.Int64)
+    excluded_total = pl.col('_excluded').cast(pl.Int64).sum().over('_row')
+    df = df.with_columns([
+        (total_duration - seconds * excluded_before).alias('_total_duration'),
+        (total_duration - seconds * excluded_total).alias('_final_duration')
+    ]).filter(~pl.col('_excluded'))
+
+    current_date_duration = (pl.col('_end_time') - pl.col('_start_time')).dt.total_seconds().cast(pl.Float64)
+    transaction_quantity = pl.col('transaction_quantity').cast(pl.Float64) * current_date_duration / pl.col('_total_duration')
+    standardized_quantity = pl.col('standardized_quantity').cast(pl.Float64) * current_date_duration / pl.col('_total_duration')
+    total_transaction_charge = transaction_quantity * pl.col('price').cast(pl.Float64) + pl.col('total_transmission_charge').cast(pl.Float64)
+    df = df.with_columns([
+        pl.col('_start_time').alias('transaction_begin_date'),
+        pl.col('_end_time').alias('transaction_end_date'),
+        pl.when(pl.col('_single')).then(pl.col('transaction_quantity')).otherwise(transaction_quantity).alias('transaction_quantity'),
+        pl.when(pl.col('_single')).then(pl.col('standardized_quantity')).otherwise(standardized_quantity).alias('standardized_quantity'),
+        pl.when(pl.col('_single')).then(pl.col('total_transaction_charge')).otherwise(total_transaction_charge).alias('total_transaction_charge'),
+        pl.when(pl.col('_single')).then(1).otherwise((pl.col('_final_duration') / seconds).ceil()).alias(duration_column)  # Convert Duration to periods
+    ])
+    return EQR_Format.add_utc_columns(df.select([pl.col(column).cast(dtype) for column, dtype in output_schema.items()]))
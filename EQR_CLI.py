@@ -0,0 +1,209 @@
+import os
+import argparse
+import functools
+import polars as pl
+import EQR_Aggregate
+import EQR_Batch
+import EQR_Bench
+import EQR_Clean
+import EQR_Cluster
+import EQR_Filter
+import EQR_Format
+import EQR_Metrics
+import EQR_Paths
+import EQR_Pipeline
+import EQR_Writer
+
+
+# Command line entry point, e.g.
+#   python EQR_CLI.py --data-dir /data/eqr --temp-dir /nvme/tmp --output-dir /data/eqr_out ingest 2019_Q2 2024_Q1 --processes 4
+#   python EQR_CLI.py ingest 2024_Q1 --cleaning study --quarantine
+#   python EQR_CLI.py breakdown 2024_Q1 --granularities hourly
+#   python EQR_CLI.py incremental 2024_Q1 --products energy --granularities hourly
+#   python EQR_CLI.py concat energy hourly --format dataset
+#   python EQR_CLI.py ingest 2024_Q1 --granularities no_breakdown daily_by_hub && python EQR_CLI.py aggregate energy
+#   python EQR_CLI.py cube energy daily
+#   python EQR_CLI.py cluster energy --weather Weather_Data/2HUB_weather.csv --non-weather Non_Weather_Data/gas_oil_cpi.csv --k 4
+#   python EQR_CLI.py bench --companies 100 --rows 20000
+
+
+# ingest: read the ZIPs of one or more Quarters once, filter every Product and write the requested Granularities
+def ingest(args):
+    if args.quantile_accuracy is not None:
+        EQR_Aggregate.configure(args.quantile_accuracy)
+    if args.utc:
+        EQR_Format.configure_utc(True)
+    main = functools.partial(EQR_Pipeline.main, products=tuple(args.products), granularities=tuple(args.granularities),
+                             compression=args.compression, write_csv=args.csv, products_config=args.products_config,
+                             cleaning=args.cleaning, quarantine=args.quarantine)
+    run(main, args)
+
+
+# breakdown: break the raw Files written by ingest down to other Granularities, the ZIPs are not read again
+def breakdown(args):
+    if args.quantile_accuracy is not None:
+        EQR_Aggregate.configure(args.quantile_accuracy)
+    if args.utc:
+        EQR_Format.configure_utc(True)
+    if args.products_config is not None:
+        EQR_Filter.load_products(args.products_config)
+    main = functools.partial(EQR_Pipeline.main_breakdown, products=tuple(args.products), granularities=tuple(args.granularities),
+                             compression=args.compression, write_csv=args.csv, cleaning=args.cleaning, quarantine=args.quarantine)
+    run(main, args)
+
+
+# incremental: rerun Quarters reprocessing only the new or refiled Company ZIPs, see EQR_Manifest
+def incremental(args):
+    if args.utc:
+        EQR_Format.configure_utc(True)
+    main = functools.partial(EQR_Pipeline.main_incremental, products=tuple(args.products), granularities=tuple(args.granularities),
+                             compression=args.compression, products_config=args.products_config)
+    run(main, args)
+
+
+# One Quarter runs in this Process, a range of Quarters goes through EQR_Batch
+def run(main, args):
+    if args.last is None or args.last == args.first:
+        main(args.first, workers=args.workers)
+    else:
+        EQR_Batch.run_batch(main, args.first, args.last, args.memory_budget, args.memory_per_quarter, args.processes, args.workers)
+
+
+# concat: every per-Quarter File of a Product and Granularity into one CSV or Parquet File, or one partitioned Dataset, in the Study directory
+def concat(args):
+    directory = EQR_Paths.output_dir(args.product, args.granularity)
+    name = f'final_{args.product}_transactions_{args.granularity}'
+    with pl.StringCache():
+        if args.format == 'csv':
+            EQR_Writer.concat_csv(directory, args.output or os.path.join(EQR_Paths.STUDY_DIRECTORY, name + '.csv'), args.workers, not args.restart)
+        elif args.format == 'parquet':
+            EQR_Writer.concat_parquet(directory, args.output or os.path.join(EQR_Paths.STUDY_DIRECTORY, name + '.parquet'), args.compression)
+        else:
+            EQR_Writer.write_quarter_dataset(directory, args.output or os.path.join(EQR_Paths.STUDY_DIRECTORY, name), args.compression)
+
+
+# aggregate: the daily_by_hub table of a Product from the per-Quarter Sketches written by the daily_by_hub Granularity
+def aggregate(args):
+    EQR_Aggregate.final_daily_by_hub(args.product, args.output or os.path.join(EQR_Paths.STUDY_DIRECTORY, f'final_{args.product}_daily_by_hub.{args.format}'))
+
+
+# cube: summary statistics of every Study_EQR_Data subgroup from the per-Quarter Files of a Product and Granularity
+def cube(args):
+    EQR_Aggregate.build_cube(args.product, args.granularity, args.output or os.path.join(EQR_Paths.STUDY_DIRECTORY, f'final_{args.product}_{args.granularity}_cube.{args.format}'),
+                             args.quantile_accuracy, args.distinct_precision)
+
+
+# cluster: standardize, PCA and k-means sweep of the daily_by_hub table of a Product (written by aggregate), see EQR_Cluster
+def cluster(args):
+    EQR_Cluster.cluster(args.daily_by_hub or os.path.join(EQR_Paths.STUDY_DIRECTORY, f'final_{args.product}_daily_by_hub.csv'),
+                        args.output_prefix or os.path.join(EQR_Paths.STUDY_DIRECTORY, f'final_{args.product}'), args.weather, args.non_weather,
+                        args.k, range(args.k_min, args.k_max + 1), args.variance, args.restarts, args.seed, args.workers, args.silhouette_sample, args.format)
+
+
+# bench: synthetic Quarter in a scratch directory under the temp root, see EQR_Bench
+def bench(args):
+    EQR_Bench.bench(args.quarter, args.companies, args.rows, args.seed, args.workers, args.chunk_size,
+                    None, args.json, args.keep, long_term_share=args.long_term_share)
+
+
+def parser():
+    parser = argparse.ArgumentParser(description='EQR Transactions Pipeline')
+    parser.add_argument('--data-dir', help='Directory of the outer (Quarter) ZIPs CSV_<year>_Q<quarter>.zip')
+    parser.add_argument('--temp-dir', help='Root of the per-run scratch directories, best on a fast local disk')
+    parser.add_argument('--output-dir', help='Root of the per-Quarter output directories')
+    parser.add_argument('--study-dir', help='Directory of the final concatenated Files and Datasets')
+    parser.add_argument('--metrics', help='Append stage records to this JSON lines File')
+    parser.add_argument('--profile', help="Profile every Quarter to this File, e.g. 'profile_{outer_zip}.prof'")
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command, function, granularities, help in [
+            ('ingest', ingest, ['no_breakdown', 'daily', 'hourly', '15min'], 'Read the ZIPs of Quarters and write every Product and Granularity'),
+            ('breakdown', breakdown, ['daily', 'hourly', '15min'], 'Break the raw Files written by ingest down to other Granularities'),
+            ('incremental', incremental, ['no_breakdown', 'daily', 'hourly', '15min'], 'Rerun Quarters, only new or refiled Company ZIPs are processed again')]:
+        subparser = subparsers.add_parser(command, help=help)
+        subparser.add_argument('first', help='First Quarter, e.g. 2019_Q2')
+        subparser.add_argument('last', nargs='?', help='Last Quarter (inclusive), only first when omitted')
+        subparser.add_argument('--products', nargs='+', default=['energy', 'ancillary'])
+        subparser.add_argument('--products-config', help='TOML File of extra Products, see EQR_Filter.load_products')
+        subparser.add_argument('--granularities', nargs='+', default=granularities, choices=list(EQR_Pipeline.SINKS))
+        subparser.add_argument('--workers', type=int, default=1, help='Processes reading the Companies of a Quarter')
+        subparser.add_argument('--processes', type=int, help='Quarters running at once')
+        subparser.add_argument('--memory-budget', type=float, default=64, help='GB for all Quarters running at once')
+        subparser.add_argument('--memory-per-quarter', type=float, default=8, help='GB per Quarter')
+        subparser.add_argument('--compression', default=EQR_Writer.COMPRESSION)
+        subparser.add_argument('--utc', action='store_true', help='Add the begin and end dates as UTC instants, from the time_zone code of every row')
+        if command != 'incremental':  # incremental rewrites the CSV Files that exist, daily_by_hub is not updated by Filing
+            subparser.add_argument('--csv', action='store_true', help='Write a CSV File next to every Parquet File')
+            subparser.add_argument('--quantile-accuracy', type=float, help='Relative accuracy of the daily_by_hub quantile Sketch, exact by default')
+            subparser.add_argument('--cleaning', help=f'Cleaning Rules of the filed rows and of the output rows of every Granularity (breakdown only uses the latter), '
+                                                      f'one of {", ".join(EQR_Clean.CLEANING)} or a TOML File, see EQR_Clean')
+            subparser.add_argument('--quarantine', action='store_true', help='Keep the rows rejected by the cleaning Rules in quarantine Files')
+        subparser.set_defaults(function=function)
+
+    subparser = subparsers.add_parser('concat', help='Concatenate the per-Quarter Files of a Product and Granularity')
+    subparser.add_argument('product')
+    subparser.add_argument('granularity')
+    subparser.add_argument('--format', choices=['csv', 'parquet', 'dataset'], default='csv')
+    subparser.add_argument('--output', help='Output File (csv, parquet) or directory (dataset), in the Study directory by default')
+    subparser.add_argument('--workers', type=int, default=4, help='Threads converting or copying Quarters at once (csv)')
+    subparser.add_argument('--restart', action='store_true', help='Start over instead of resuming from the index of the output (csv)')
+    subparser.add_argument('--compression', default=EQR_Writer.COMPRESSION)
+    subparser.set_defaults(function=concat)
+
+    subparser = subparsers.add_parser('aggregate', help='Build the daily_by_hub table of a Product from its per-Quarter Sketches')
+    subparser.add_argument('product')
+    subparser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    subparser.add_argument('--output', help='Output File, in the Study directory by default')
+    subparser.set_defaults(function=aggregate)
+
+    subparser = subparsers.add_parser('cube', help='Summary statistics of every Study_EQR_Data subgroup in one pass')
+    subparser.add_argument('product')
+    subparser.add_argument('granularity', nargs='?', default='daily')
+    subparser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    subparser.add_argument('--output', help='Output File, in the Study directory by default')
+    subparser.add_argument('--quantile-accuracy', type=float, default=EQR_Aggregate.CUBE_QUANTILE_ACCURACY, help='Relative accuracy of the quantiles')
+    subparser.add_argument('--distinct-precision', type=int, help='HyperLogLog precision of the distinct Transactions, exact by default')
+    subparser.set_defaults(function=cube)
+
+    subparser = subparsers.add_parser('cluster', help='Cluster the days and Hubs of the daily_by_hub table with PCA and k-means')
+    subparser.add_argument('product')
+    subparser.add_argument('--daily-by-hub', help='daily_by_hub File, final_<product>_daily_by_hub.csv in the Study directory by default')
+    subparser.add_argument('--weather', help='Weather CSV File joined by date and Hub')
+    subparser.add_argument('--non-weather', help='Non-weather CSV File (gas, oil, CPI) joined by date')
+    subparser.add_argument('--k', type=int, help='Number of Clusters of the labels, the k with the best silhouette by default')
+    subparser.add_argument('--k-min', type=int, default=min(EQR_Cluster.K_VALUES))
+    subparser.add_argument('--k-max', type=int, default=max(EQR_Cluster.K_VALUES))
+    subparser.add_argument('--variance', type=float, default=EQR_Cluster.VARIANCE, help='Share of the variance kept by the Principal Components')
+    subparser.add_argument('--restarts', type=int, default=EQR_Cluster.RESTARTS, help='k-means runs per k, the best one is kept')
+    subparser.add_argument('--seed', type=int, default=EQR_Cluster.SEED)
+    subparser.add_argument('--workers', type=int, help='Processes running the k-means runs, every core by default')
+    subparser.add_argument('--silhouette-sample', type=int, default=EQR_Cluster.SILHOUETTE_SAMPLE, help='Rows whose silhouette is averaged')
+    subparser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    subparser.add_argument('--output-prefix', help='Prefix of the output Files, final_<product> in the Study directory by default')
+    subparser.set_defaults(function=cluster)
+
+    subparser = subparsers.add_parser('bench', help='Benchmark the Pipeline on a synthetic Quarter')
+    subparser.add_argument('--quarter', default='2024_Q1')
+    subparser.add_argument('--companies', type=int, default=50)
+    subparser.add_argument('--rows', type=int, default=10000, help='Average Transactions per Company')
+    subparser.add_argument('--long-term-share', type=float, default=0.03)
+    subparser.add_argument('--seed', type=int, default=0)
+    subparser.add_argument('--workers', type=int, default=1)
+    subparser.add_argument('--chunk-size', type=int, default=10000)
+    subparser.add_argument('--json', help='Append the stage results to this JSON lines File')
+    subparser.add_argument('--keep', action='store_true', help='Keep the synthetic Quarter and outputs')
+    subparser.set_defaults(function=bench)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    EQR_Paths.configure(args.data_dir, args.temp_dir, args.output_dir, args.study_dir)
+    if args.metrics is not None or args.profile is not None:
+        EQR_Metrics.configure(args.metrics, args.profile, args.profiler)
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
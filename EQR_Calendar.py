@@ -0,0 +1,101 @@
+import holidays
+import datetime
+import functools
+import polars as pl
+
+
+# Hours covered by the precomputed Calendar (EQR Study period plus most long-term Contracts)
+FIRST_YEAR = 2014
+LAST_YEAR = 2030
+CALENDAR_START = datetime.datetime(FIRST_YEAR, 1, 1)
+
+NERC_HOLIDAY_NAMES = {"New Year's Day", 'Memorial Day', 'Independence Day', 'Labor Day', 'Thanksgiving', 'Christmas Day'}
+
+
+def NERC_holiday(year):
+    us_holidays = holidays.UnitedStates(years=year)
+    NERC_holidays = []
+    for k, v in us_holidays.items():
+        if v in NERC_HOLIDAY_NAMES:
+            NERC_holidays.append(k)
+    return NERC_holidays
+
+
+# Build the hour-indexed Calendar once per process
+# Row i is the hour CALENDAR_START + i hours, so a lookup is a single gather instead of a Holiday search
+@functools.lru_cache(maxsize=None)
+def calendar_table():
+    NERC_holidays = [day for year in range(FIRST_YEAR, LAST_YEAR + 1) for day in NERC_holiday(year)]
+    hours = pl.datetime_range(CALENDAR_START, datetime.datetime(LAST_YEAR, 12, 31, 23), interval='1h', eager=True)
+    df = pl.DataFrame({'hour': hours}).with_columns(
+        pl.col('hour').dt.date().is_in(NERC_holidays).alias('is_holiday')
+    )
+    # Peak Days are Monday to Saturday excluding NERC Holidays, Peak Hours are HE7 to HE22 on Peak Days
+    df = df.with_columns(
+        ((pl.col('hour').dt.weekday() != 7) & ~pl.col('is_holiday')).alias('is_peak_day')
+    )
+    df = df.with_columns(
+        (pl.col('is_peak_day') & pl.col('hour').dt.hour().is_between(6, 21)).alias('is_peak')
+    )
+    return df
+
+
+# NERC Holidays for Years outside of the Calendar, only generated if a Transaction falls there
+# A Python list, is_in with a Series of the same type is deprecated in Polars 2
+@functools.lru_cache(maxsize=None)
+def outside_holidays():
+    years = list(range(1990, FIRST_YEAR)) + list(range(LAST_YEAR + 1, 2101))
+    return [day for year in years for day in NERC_holiday(year)]
+
+
+def lookup(column, timestamp):
+    table = calendar_table()
+    index = (timestamp.dt.truncate('1h') - pl.lit(CALENDAR_START)).dt.total_hours()
+    in_calendar = index.is_between(0, table.height - 1)
+    is_holiday = timestamp.dt.date().is_in(outside_holidays())
+    is_peak_day = (timestamp.dt.weekday() != 7) & ~is_holiday
+    rules = {
+        'is_holiday': is_holiday,
+        'is_peak_day': is_peak_day,
+        'is_peak': is_peak_day & timestamp.dt.hour().is_between(6, 21)
+    }
+    return (pl.when(in_calendar)
+            .then(pl.lit(table[column]).gather(index.clip(0, table.height - 1)))
+            .otherwise(rules[column])
+            .alias(column))
+
+
+# Expressions for Breakdowns and other vectorized Code
+def holiday_flag(timestamp):
+    return lookup('is_holiday', timestamp)
+
+
+def peak_day_flag(timestamp):
+    return lookup('is_peak_day', timestamp)
+
+
+def peak_flag(timestamp):
+    return lookup('is_peak', timestamp)
+
+
+# Series and single Datetime versions
+def holiday_mask(series):
+    return series.to_frame('timestamp').select(holiday_flag(pl.col('timestamp'))).to_series()
+
+
+def peak_mask(series):
+    return series.to_frame('timestamp').select(peak_flag(pl.col('timestamp'))).to_series()
+
+
+def is_holiday(ts):
+    index = int((ts - CALENDAR_START).total_seconds() // 3600)
+    if 0 <= index < calendar_table().height:
+        return calendar_table()['is_holiday'][index]
+    return holiday_mask(pl.Series([ts]))[0]
+
+
+def is_peak(ts):
+    index = int((ts - CALENDAR_START).total_seconds() // 3600)
+    if 0 <= index < calendar_table().height:
+        return calendar_table()['is_peak'][index]
+    return peak_mask(pl.Series([ts]))[0]
@@ -0,0 +1,114 @@
+import os
+import tomllib
+import polars as pl
+import EQR_Metrics
+
+
+# Cleaning Rules of the Study, applied once while ingesting instead of on every load of the Data
+# A Rule keeps the rows meeting all of its conditions ({column: {operator: value}}), with reject = true it drops them instead
+# A condition on a missing value fails, like a filter in R
+# stage picks the rows a Rule sees: 'filed' (the default) the filed Transactions right after the Product filter,
+# 'breakdown' the output rows of every Granularity, e.g. the prorated transaction_quantity of each day or hour
+# Study_EQR_Data filters the daily rows, so its quantity limits only drop the days (or hours) over the limit, not the whole Contract
+STUDY_RULES = {
+    'price_range': {'price': {'between': [-20, 2000]}},  # Prices between -20 and 2000 $/MWh, the same for the filed and broken down rows
+    'positive_quantity': {'stage': 'breakdown', 'transaction_quantity': {'greater_than': 0}},
+    'free_bulk_energy': {'stage': 'breakdown', 'reject': True, 'price': {'equal': 0}, 'transaction_quantity': {'greater_than': 10000}},  # Price 0 with more than 10000 MWh
+    'quantity_limit': {'stage': 'breakdown', 'transaction_quantity': {'less_equal': 50000}}
+}
+
+# Cluster_Analysis adds $/MWH prices and complete rows
+CLUSTER_RULES = dict(STUDY_RULES, **{
+    'mwh_units': {'rate_units': {'equal': '$/MWH'}},
+    'complete': {'price': {'not_null': True}, 'transaction_quantity': {'not_null': True}}
+})
+
+# Rule Sets by name, each lists the Rules of every Product ({product: {rule name: rule}})
+CLEANING = {
+    'study': {'energy': STUDY_RULES},
+    'cluster': {'energy': CLUSTER_RULES}
+}
+
+STAGES = ['filed', 'breakdown']
+
+OPERATORS = {
+    'equal': lambda column, value: column == value,
+    'not_equal': lambda column, value: column != value,
+    'less_than': lambda column, value: column < value,
+    'less_equal': lambda column, value: column <= value,
+    'greater_than': lambda column, value: column > value,
+    'greater_equal': lambda column, value: column >= value,
+    'between': lambda column, value: column.is_between(value[0], value[1]),
+    'in': lambda column, value: column.is_in([float(item) if isinstance(item, int) else item for item in value]),
+    'not_null': lambda column, value: column.is_not_null() if value else column.is_null()
+}
+
+
+# Categorical columns are compared as strings, Float32 columns (price, transaction_quantity) as Float64
+def column_expression(column, value):
+    values = value if isinstance(value, list) else [value]
+    if len(values) > 0 and all(isinstance(item, str) for item in values):
+        return pl.col(column).cast(pl.Utf8)
+    if len(values) > 0 and all(isinstance(item, (int, float)) and not isinstance(item, bool) for item in values):
+        return pl.col(column).cast(pl.Float64)
+    return pl.col(column)
+
+
+# Expression of a Rule, true for the rows it keeps
+def rule_expression(rule):
+    if rule.get('stage', 'filed') not in STAGES:
+        raise ValueError(f'Unknown cleaning stage {rule["stage"]}, use one of {", ".join(STAGES)}')
+    expression = pl.lit(True)
+    for column, conditions in rule.items():
+        if column in ['reject', 'stage']:
+            continue
+        for operator, value in conditions.items():
+            if operator not in OPERATORS:
+                raise ValueError(f'Unknown cleaning operator {operator}, use one of {", ".join(OPERATORS)}')
+            expression = expression & OPERATORS[operator](column_expression(column, value), value)
+    if rule.get('reject', False):
+        expression = ~expression
+    return expression.fill_null(False)
+
+
+# Rules of one stage, e.g. stage_rules(STUDY_RULES, 'breakdown')
+def stage_rules(rules, stage):
+    return {name: rule for name, rule in rules.items() if rule.get('stage', 'filed') == stage}
+
+
+# Split rows into the rows passing every Rule and the rejected rows, all Rules are evaluated in the same pass
+# Rows failing each Rule are counted in totals (rejected_<rule>), a row failing several Rules counts for each of them
+def clean(df, rules, totals=None):
+    flags = df.select([rule_expression(rule).alias(name) for name, rule in rules.items()])
+    keep = flags.select(pl.all_horizontal(pl.all())).to_series() if flags.width > 0 else pl.repeat(True, df.height, eager=True)
+    kept = df.filter(keep)
+    if totals is not None:
+        EQR_Metrics.count(totals, 'rows_in', df.height)
+        EQR_Metrics.count(totals, 'rows_out', kept.height)
+        for name in flags.columns:
+            EQR_Metrics.count(totals, 'rejected_' + name, df.height - flags[name].sum())
+    return kept, df.filter(~keep)
+
+
+# Rules of a Rule Set name (see CLEANING) or of a TOML File, one [cleaning.<product>.<rule>] table per Rule:
+#
+# [cleaning.energy.price_range]
+# price = { between = [-20, 2000] }
+#
+# [cleaning.energy.free_bulk_energy]
+# stage = "breakdown"
+# reject = true
+# price = { equal = 0 }
+# transaction_quantity = { greater_than = 10000 }
+def load_cleaning(name_or_path):
+    if name_or_path in CLEANING:
+        return CLEANING[name_or_path]
+    if not os.path.exists(name_or_path):
+        raise ValueError(f'Unknown cleaning Rule Set {name_or_path}, use a TOML File or one of {", ".join(CLEANING)}')
+    with open(name_or_path, 'rb') as file:
+        config = tomllib.load(file)
+    cleaning = config.get('cleaning', {})
+    for rules in cleaning.values():
+        for rule in rules.values():
+            rule_expression(rule)  # unknown operators fail before the Quarter is read
+    return cleaning
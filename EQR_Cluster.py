@@ -0,0 +1,208 @@
+import os
+import concurrent.futures
+import multiprocessing
+import numpy as np
+import polars as pl
+import EQR_Metrics
+
+
+# Clustering variables of Cluster_Analysis.Rmd: the daily_by_hub aggregate, the weather and the non-weather Data
+FEATURES = [
+    'avg_price', 'median_price', 'price_sd', 'avg_price_sd_ratio',
+    'avg_quantity', 'median_quantity', 'quantity_sd', 'avg_quantity_sd_ratio',
+    'num_transactions',
+    'precipitation', 'max_temp', 'min_temp', 'avg_temp', 'avg_wind_speed',
+    'max_2min_wind_speed', 'max_5s_wind_speed', 'none', 'abnormally_dry',
+    'moderate_drought', 'severe_drought', 'extreme_drought', 'exceptional_drought',
+    'gas_price', 'oil_price', 'crude_net_import', 'oil_production',
+    'sticky_core_cpi', 'flexible_core_cpi'
+]
+
+KEYS = ['transaction_begin_date', 'hub']
+
+# Defaults of the Rmd: k up to 10, 25 restarts (nstart) and seed 123
+K_VALUES = range(2, 11)
+RESTARTS = 25
+SEED = 123
+VARIANCE = 0.9  # Share of the variance kept by the Principal Components, the Rmd keeps 13 of 28 Components for 91.63 %
+SILHOUETTE_SAMPLE = 2000  # Rows whose silhouette is averaged, the distances go to every row so the cost is sample x rows instead of rows x rows
+MAX_ITERATIONS = 100
+
+
+def read_table(path):
+    if path.endswith('.parquet'):
+        return pl.read_parquet(path)
+    return pl.read_csv(path, infer_schema_length=10000)
+
+
+def write_table(df, path):
+    if path.endswith('.parquet'):
+        df.write_parquet(path)
+    else:
+        df.write_csv(path)
+
+
+# daily_by_hub joined to the weather Data (by date and hub) and the non-weather Data (by date), dates of both are written %m/%d/%Y
+def load_features(daily_by_hub_path, weather_path=None, non_weather_path=None):
+    df = read_table(daily_by_hub_path).with_columns(pl.col('transaction_begin_date').cast(pl.Utf8).str.to_date())
+    if weather_path is not None:
+        weather = read_table(weather_path).with_columns(pl.col('date').cast(pl.Utf8).str.to_date('%m/%d/%Y'),
+                                                        pl.col('hub').str.to_uppercase())  # daily_by_hub Hubs are upper case
+        df = df.join(weather.rename({'date': 'transaction_begin_date'}), on=KEYS, how='left')
+    if non_weather_path is not None:
+        non_weather = read_table(non_weather_path).with_columns(pl.col('date').cast(pl.Utf8).str.to_date('%m/%d/%Y'))
+        df = df.join(non_weather.rename({'date': 'transaction_begin_date'}), on='transaction_begin_date', how='left')
+    return df.sort(KEYS)
+
+
+# Scale every column to mean 0 and standard deviation 1 like scale() in R, constant columns are only centered
+def standardize(x):
+    sd = x.std(axis=0, ddof=1)
+    return (x - x.mean(axis=0)) / np.where(sd > 0, sd, 1)
+
+
+# Principal Components of standardized rows like prcomp(), the first Components explaining at least variance of the total are kept
+# Returns the scores of the kept Components and the standard deviation and variance shares of every Component
+def pca(x, variance=VARIANCE):
+    u, s, vt = np.linalg.svd(x, full_matrices=False)
+    shares = s ** 2 / (s ** 2).sum()
+    components = min(int(np.searchsorted(np.cumsum(shares), variance - 1e-12)) + 1, len(s))
+    return u[:, :components] * s[:components], s / np.sqrt(max(len(x) - 1, 1)), shares
+
+
+def squared_distances(x, centers):
+    return np.maximum((x ** 2).sum(axis=1)[:, None] - 2 * x @ centers.T + (centers ** 2).sum(axis=1)[None, :], 0)
+
+
+# k-means++ seeding: every next Center is drawn with a probability proportional to the squared distance to the nearest Center
+def initial_centers(x, k, rng):
+    centers = np.empty((k, x.shape[1]))
+    centers[0] = x[rng.integers(len(x))]
+    distances = ((x - centers[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        total = distances.sum()
+        centers[i] = x[rng.choice(len(x), p=distances / total) if total > 0 else rng.integers(len(x))]
+        distances = np.minimum(distances, ((x - centers[i]) ** 2).sum(axis=1))
+    return centers
+
+
+# One k-means run (Lloyd iterations from a k-means++ seeding), an empty Cluster restarts from the row farthest from its Center
+# Returns the within Sum of Squares, the labels and the iterations
+def kmeans(x, k, seed, max_iterations=MAX_ITERATIONS):
+    rng = np.random.default_rng(seed)
+    centers = initial_centers(x, k, rng)
+    labels = None
+    for iteration in range(1, max_iterations + 1):
+        distances = squared_distances(x, centers)
+        new_labels = distances.argmin(axis=1)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k)
+        for cluster in np.flatnonzero(counts == 0):
+            farthest = distances[np.arange(len(x)), labels].argmax()
+            labels[farthest] = cluster
+            distances[farthest] = 0
+            counts = np.bincount(labels, minlength=k)
+        centers = np.stack([np.bincount(labels, weights=x[:, j], minlength=k) for j in range(x.shape[1])], axis=1) / counts[:, None]
+    wss = float(squared_distances(x, centers)[np.arange(len(x)), labels].sum())
+    return wss, labels, iteration
+
+
+# Rows clustered by every Worker, they are sent once when the Worker starts
+worker_x = None
+
+
+def init_worker(x):
+    global worker_x
+    worker_x = x
+
+
+# Seeds come from (seed, k, restart), so the result does not depend on the Workers or the order the runs finish in
+def run_restart(k, restart, seed):
+    wss, labels, iterations = kmeans(worker_x, k, [seed, k, restart])
+    return k, restart, wss, labels, iterations
+
+
+# Mean silhouette of a sample of the rows, from their distances to every row, in blocks of rows to bound the Memory
+def sampled_silhouette(x, labels, sample_size=SILHOUETTE_SAMPLE, seed=SEED, block_size=500):
+    k = labels.max() + 1
+    counts = np.bincount(labels, minlength=k)
+    if k < 2:
+        return float('nan')
+    rng = np.random.default_rng([seed, k])
+    sample = np.arange(len(x)) if len(x) <= sample_size else np.sort(rng.choice(len(x), sample_size, replace=False))
+    one_hot = np.eye(k)[labels]
+    scores = []
+    for start in range(0, len(sample), block_size):
+        rows = sample[start:start + block_size]
+        sums = np.sqrt(squared_distances(x[rows], x)) @ one_hot
+        own = labels[rows]
+        own_counts = counts[own] - 1
+        a = sums[np.arange(len(rows)), own] / np.maximum(own_counts, 1)
+        sums[np.arange(len(rows)), own] = np.inf
+        b = np.where(counts > 0, sums / np.maximum(counts, 1), np.inf).min(axis=1)
+        score = np.where(own_counts > 0, (b - a) / np.maximum(a, b), 0)  # A Cluster of a single row scores 0, as in cluster::silhouette
+        scores.append(score)
+    return float(np.concatenate(scores).mean())
+
+
+# k-means for every k with restarts runs, all runs of all k go to a pool of Workers (every core by default)
+# Returns the sweep ({k, wss, silhouette, iterations} of the best run of every k) and the labels of the best run of every k
+def sweep(x, k_values=K_VALUES, restarts=RESTARTS, seed=SEED, workers=None, sample_size=SILHOUETTE_SAMPLE):
+    workers = os.cpu_count() if workers is None else workers
+    runs = [(k, restart) for k in k_values for restart in range(restarts)]
+    best = {}
+    with EQR_Metrics.stage('kmeans', rows_in=len(x), runs=len(runs), workers=workers):
+        if workers <= 1:
+            init_worker(x)
+            results = [run_restart(k, restart, seed) for k, restart in runs]
+        else:
+            # Polars is not fork-safe, Workers are always spawned
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                                        initializer=init_worker, initargs=(x,)) as executor:
+                results = list(executor.map(run_restart, *zip(*runs), [seed] * len(runs), chunksize=max(1, len(runs) // (workers * 4))))
+        for k, restart, wss, labels, iterations in results:
+            if k not in best or wss < best[k][0]:  # the first restart wins ties
+                best[k] = (wss, labels, iterations)
+    with EQR_Metrics.stage('silhouette', rows_in=len(x), sample=min(sample_size, len(x))):
+        rows = [{'k': k, 'wss': wss, 'silhouette': sampled_silhouette(x, labels, sample_size, seed), 'iterations': iterations}
+                for k, (wss, labels, iterations) in sorted(best.items())]
+    return pl.DataFrame(rows), {k: labels for k, (wss, labels, iterations) in best.items()}
+
+
+# Cluster the days and Hubs: standardize, keep the Principal Components explaining variance, then sweep k over k_values
+# k picks the labels to keep, by default the k with the highest silhouette
+# Writes <output_prefix>_clusters (cluster of every day and Hub, empty for rows with a missing feature like na.omit in R),
+# <output_prefix>_cluster_profiles (rows and feature means of every Cluster), <output_prefix>_cluster_sweep and <output_prefix>_pca
+def cluster(daily_by_hub_path, output_prefix, weather_path=None, non_weather_path=None, k=None, k_values=K_VALUES, variance=VARIANCE,
+            restarts=RESTARTS, seed=SEED, workers=None, sample_size=SILHOUETTE_SAMPLE, output_format='csv'):
+    df = load_features(daily_by_hub_path, weather_path, non_weather_path).with_row_index('_row')
+    features = [feature for feature in FEATURES if feature in df.columns]
+    complete = df.drop_nulls(features)
+    print(f'Cluster {complete.height} of {df.height} rows on {len(features)} features.')
+    x = standardize(complete.select(pl.col(features).cast(pl.Float64)).to_numpy())
+    scores, sd, shares = pca(x, variance)
+    print(f'{scores.shape[1]} Principal Components explain {shares[:scores.shape[1]].sum():.2%} of the variance.')
+    k_values = sorted(set(k_values) | ({k} if k is not None else set()))
+    sweep_df, labels = sweep(scores, k_values, restarts, seed, workers, sample_size)
+    print(sweep_df)
+    k = int(sweep_df.sort('silhouette', descending=True)['k'][0]) if k is None else k
+    print(f'Keep the labels of k = {k}.')
+
+    clusters = complete.select('_row', pl.Series('cluster', labels[k] + 1, dtype=pl.UInt8))  # Clusters 1 to k like kmeans() in R
+    clustered = df.join(clusters, on='_row', how='left').drop('_row')
+    profiles = clustered.filter(pl.col('cluster').is_not_null()).group_by('cluster').agg(
+        pl.len().alias('rows'), pl.col(features).cast(pl.Float64).mean()).sort('cluster')
+    components = pl.DataFrame({
+        'component': [f'PC{i + 1}' for i in range(len(sd))],
+        'standard_deviation': sd,
+        'proportion_of_variance': shares,
+        'cumulative_proportion': np.cumsum(shares),
+        'kept': np.arange(len(sd)) < scores.shape[1]
+    })
+    os.makedirs(os.path.dirname(os.path.abspath(output_prefix)), exist_ok=True)
+    for name, table in [('clusters', clustered.select(KEYS + ['cluster'])), ('cluster_profiles', profiles),
+                        ('cluster_sweep', sweep_df), ('pca', components)]:
+        write_table(table, f'{output_prefix}_{name}.{output_format}')
+    return clustered, profiles, sweep_df
@@ -0,0 +1,80 @@
+import tomllib
+import polars as pl
+
+
+# Product Datasets built by the Pipeline
+# Each Product lists the allowed (upper case) values of the filter columns, a missing key allows every value
+PRODUCTS = {
+    'energy': {
+        'locations': ['MID-COLUMBIA (MID-C)', 'COB'],  # Only Mid-C and COB Trade Hub
+        'balancing_authorities': ['HUB'],  # Only Delivery to Trade Hub
+        'product_names': ['ENERGY']  # Only Energy Product
+    },
+    'ancillary': {
+        'product_names': ['CAPACITY', 'REGULATION & FREQUENCY RESPONSE', 'PRIMARY FREQUENCY RESPONSE']
+    }
+}
+
+RULE_COLUMNS = {
+    'locations': 'point_of_delivery_specific_location',
+    'balancing_authorities': 'point_of_delivery_balancing_authority',
+    'product_names': 'product_name'
+}
+
+
+# Filter expression of one Product, comparisons ignore case
+def product_expression(rule):
+    expression = pl.lit(True)
+    for key, column in RULE_COLUMNS.items():
+        if key in rule:
+            expression = expression & pl.col(column).cast(pl.Utf8).str.to_uppercase().is_in([value.upper() for value in rule[key]])
+    return expression
+
+
+def filter_energy(df):
+    return df.filter(product_expression(PRODUCTS['energy']))
+
+
+def filter_ancillary(df):
+    return df.filter(product_expression(PRODUCTS['ancillary']))
+
+
+# Keep the rows of any of the Products, used while reading so every Product comes out of the same scan
+# Use functools.partial(filter_products, rules) where a one argument filter_function is expected
+def filter_products(rules, df):
+    return df.filter(pl.any_horizontal([product_expression(rule) for rule in rules.values()]))
+
+
+# Split rows into one DataFrame per Product, every predicate is evaluated in the same pass and a row can go to several Products
+def route(df, rules):
+    flags = df.select([product_expression(rule).fill_null(False).alias(name) for name, rule in rules.items()])
+    return {name: df.filter(flags[name]) for name in rules}
+
+
+# Add (or replace) a Product, e.g. register_product('spinning_reserve', ['SPINNING RESERVE'])
+def register_product(name, product_names=None, locations=None, balancing_authorities=None):
+    rule = {}
+    if locations is not None:
+        rule['locations'] = list(locations)
+    if balancing_authorities is not None:
+        rule['balancing_authorities'] = list(balancing_authorities)
+    if product_names is not None:
+        rule['product_names'] = list(product_names)
+    PRODUCTS[name] = rule
+
+
+# Register the Products of a TOML File, one [products.<name>] table per Product:
+#
+# [products.spinning_reserve]
+# product_names = ["SPINNING RESERVE"]
+#
+# [products.palo_verde_energy]
+# product_names = ["ENERGY"]
+# locations = ["PALO VERDE"]
+# balancing_authorities = ["HUB"]
+def load_products(path):
+    with open(path, 'rb') as file:
+        config = tomllib.load(file)
+    for name, rule in config.get('products', {}).items():
+        register_product(name, **rule)
+    return list(config.get('products', {}))
@@ -0,0 +1,113 @@
+import os
+import polars as pl
+
+
+# Schema of the transactions.csv Files in the EQR ZIPs
+DATATYPES = {
+            'transaction_unique_id': pl.Utf8,
+            'seller_company_name': pl.Utf8,
+            'customer_company_name': pl.Utf8,
+            'ferc_tariff_reference': pl.Utf8,
+            'contract_service_agreement': pl.Utf8,
+            'transaction_unique_identifier': pl.Utf8,
+            'transaction_begin_date': pl.Utf8,
+            'transaction_end_date': pl.Utf8,
+            'trade_date': pl.UInt32,
+            'exchange_brokerage_service': pl.Utf8,
+            'type_of_rate': pl.Categorical,
+            'time_zone':pl.Categorical,
+            'point_of_delivery_balancing_authority': pl.Utf8,
+            'point_of_delivery_specific_location': pl.Utf8,
+            'class_name': pl.Categorical,
+            'term_name': pl.Categorical,
+            'increment_name': pl.Categorical,
+            'increment_peaking_name': pl.Categorical,
+            'product_name': pl.Utf8,
+            'transaction_quantity': pl.Float32,
+            'price': pl.Float32,
+            'rate_units' : pl.Categorical,
+            'standardized_quantity': pl.Utf8,
+            'standardized_price': pl.Utf8,
+            'total_transmission_charge': pl.Float32,
+            'total_transaction_charge': pl.Utf8
+        }
+
+
+# transaction_begin_date and transaction_end_date from parsing to the outputs: the filed wall-clock time, to the minute
+# Milliseconds are the coarsest Polars and Parquet time unit, every value is a whole minute
+DATETIME = pl.Datetime('ms')
+
+# Text format of Datetimes in CSV outputs, the one the R Study parses with as.POSIXct
+DATETIME_FORMAT = '%Y/%m/%d %H:%M'
+
+# EQR time_zone codes: Prevailing follows daylight saving time, Standard and Daylight are fixed offsets
+TIME_ZONES = {
+    'AP': 'America/Halifax', 'EP': 'America/New_York', 'CP': 'America/Chicago', 'MP': 'America/Denver', 'PP': 'America/Los_Angeles',
+    'AS': 'Etc/GMT+4', 'ES': 'Etc/GMT+5', 'CS': 'Etc/GMT+6', 'MS': 'Etc/GMT+7', 'PS': 'Etc/GMT+8',
+    'AD': 'Etc/GMT+3', 'ED': 'Etc/GMT+4', 'CD': 'Etc/GMT+5', 'MD': 'Etc/GMT+6', 'PD': 'Etc/GMT+7'
+}
+
+
+# A wall-clock Datetime column with the time_zone code of its row applied, as a UTC instant
+# A Polars column has a single time zone and the Filings mix them, so the outputs keep the wall-clock time (peak Hours and Days are wall-clock too)
+# and the UTC instants are added next to them on request, see add_utc_columns
+def utc_datetime(column):
+    time_zone = pl.col('time_zone').cast(pl.Utf8).str.to_uppercase()
+    utc = pl.lit(None, dtype=pl.Datetime('ms', 'UTC'))
+    for code, zone in TIME_ZONES.items():
+        local = pl.col(column).dt.replace_time_zone(zone, ambiguous='earliest', non_existent='null').dt.convert_time_zone('UTC')
+        utc = pl.when(time_zone == code).then(local).otherwise(utc)
+    return utc.alias(column + '_utc')
+
+
+# Add transaction_begin_date_utc and transaction_end_date_utc to the outputs, set through configure_utc or the EQR_UTC_COLUMNS environment variable
+UTC_COLUMNS = os.environ.get('EQR_UTC_COLUMNS') == '1'
+
+
+# The environment is updated too so spawned Processes (Batches) write the same columns
+def configure_utc(utc_columns=False):
+    global UTC_COLUMNS
+    UTC_COLUMNS = utc_columns
+    if utc_columns:
+        os.environ['EQR_UTC_COLUMNS'] = '1'
+    else:
+        os.environ.pop('EQR_UTC_COLUMNS', None)
+
+
+# UTC instants of the begin and end of every row (of the period after a Breakdown) when UTC_COLUMNS is set
+def add_utc_columns(df):
+    if not UTC_COLUMNS:
+        return df
+    return df.with_columns(utc_datetime('transaction_begin_date'), utc_datetime('transaction_end_date'))
+
+
+# Fix the Datatypes, EQR Files store Datetimes and some numbers as text
+def fix_datatypes(df):
+    return df.with_columns([
+        pl.col('transaction_begin_date').str.to_datetime(format="%Y%m%d%H%M", time_unit='ms'),
+        pl.col('transaction_end_date').str.to_datetime(format="%Y%m%d%H%M", time_unit='ms'),
+        pl.col('standardized_quantity').cast(pl.Float32),
+        pl.col('total_transaction_charge').cast(pl.Float32)
+    ])
+
+
+# Fix standardized_quantity and standardized_price errors
+# A missing standardized_quantity is 0, and $/MWH Transactions fall back to transaction_quantity and price
+def fix_errors(df):
+    is_mwh = pl.col('rate_units') == '$/MWH'
+    standardized_quantity = pl.col('standardized_quantity').fill_null(0)
+    return df.with_columns([
+        pl.when((standardized_quantity == 0) & pl.col('transaction_quantity').ne_missing(0) & is_mwh)
+        .then(pl.col('transaction_quantity'))
+        .otherwise(standardized_quantity)
+        .alias('standardized_quantity'),
+        pl.when(pl.col('standardized_price').is_null() & is_mwh)
+        .then(pl.col('price').cast(pl.Float64).cast(pl.Utf8))
+        .otherwise(pl.col('standardized_price'))
+        .alias('standardized_price')
+    ])
+
+
+# Both steps in one pass, shared by the no Breakdown, daily and hourly Pipelines
+def fix_data_format(df):
+    return fix_errors(fix_datatypes(df))
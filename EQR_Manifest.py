@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import zipfile
+import datetime
+import urllib.parse
+import polars as pl
+import EQR_Metrics
+import EQR_Reader
+import EQR_Writer
+
+
+# Open (and create if needed) the Manifest of processed Company Filings
+# A Filing is one inner (Company) ZIP of an outer (Quarter) ZIP, identified by its CRC32 and size
+def connect(manifest_path):
+    conn = sqlite3.connect(manifest_path, timeout=60)  # Quarters running side by side share the Manifest
+    conn.execute('''CREATE TABLE IF NOT EXISTS filings (
+                        outer_zip TEXT NOT NULL,
+                        member TEXT NOT NULL,
+                        crc32 INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        rows INTEGER NOT NULL,
+                        processed_at TEXT NOT NULL,
+                        PRIMARY KEY (outer_zip, member))''')
+    return conn
+
+
+# Compare the members of an outer ZIP with the Manifest
+# Returns the members that are new or changed, and the members of the Manifest that are gone from the ZIP
+def changed_members(conn, outer_file):
+    outer_zip = os.path.basename(outer_file)
+    known = {member: (crc32, size) for member, crc32, size in
+             conn.execute('SELECT member, crc32, size FROM filings WHERE outer_zip = ?', (outer_zip,))}
+    with zipfile.ZipFile(outer_file) as zf_outer:
+        infos = zf_outer.infolist()
+    changed = [info for info in infos if known.get(info.filename) != (info.CRC, info.file_size)]
+    names = {info.filename for info in infos}
+    removed = [member for member in known if member not in names]
+    return changed, removed
+
+
+# Breakdown output of one Filing is kept in cache_dir/<outer ZIP>/<member>.parquet
+def filing_path(cache_dir, outer_file, member):
+    outer_zip = os.path.basename(outer_file)
+    return os.path.join(cache_dir, outer_zip[:-len('.zip')], urllib.parse.quote(member, safe='') + '.parquet')
+
+
+# Bring one Quarter up to date: only new or changed Filings are filtered and broken down again,
+# then the per-Quarter output is rebuilt from the Filing Files in the order of the outer ZIP
+def update_quarter(outer_file, schema, filter_function, breakdown, cache_dir, output_path, workers=1,
+                   compression=EQR_Writer.COMPRESSION, chunk_size=10000):
+    outer_zip = os.path.basename(outer_file)
+    with EQR_Metrics.scope(outer_zip=outer_zip), EQR_Metrics.profile(), EQR_Metrics.stage('quarter') as record:
+        record['rows_out'] = update_filings(outer_file, schema, filter_function, breakdown, cache_dir, output_path, workers, compression, chunk_size)
+
+
+# Body of update_quarter, returns the number of rows of the rebuilt output
+def update_filings(outer_file, schema, filter_function, breakdown, cache_dir, output_path, workers=1,
+                   compression=EQR_Writer.COMPRESSION, chunk_size=10000):
+    outer_zip = os.path.basename(outer_file)
+    os.makedirs(os.path.join(cache_dir, outer_zip[:-len('.zip')]), exist_ok=True)
+    conn = connect(os.path.join(cache_dir, 'manifest.sqlite'))
+    try:
+        changed, removed = changed_members(conn, outer_file)
+        print(len(changed), 'new or changed and', len(removed), 'removed Filings in', outer_zip + '.')
+
+        for member in removed:
+            if os.path.exists(filing_path(cache_dir, outer_file, member)):
+                os.remove(filing_path(cache_dir, outer_file, member))
+            conn.execute('DELETE FROM filings WHERE outer_zip = ? AND member = ?', (outer_zip, member))
+        conn.commit()
+
+        infos = {info.filename: info for info in changed}
+        for member, df_list in EQR_Reader.iter_members(outer_file, schema, filter_function, set(infos), workers):
+            path = filing_path(cache_dir, outer_file, member)
+            rows = sum(df.height for df in df_list)
+            if rows > 0:
+                with EQR_Metrics.stage('breakdown', company=member) as record:
+                    df = pl.concat(df_list)
+                    breakdown_df = pl.concat([breakdown(pl.DataFrame(chunk, schema=schema)) for chunk in df.iter_slices(chunk_size)])
+                    record['rows_in'], record['rows_out'] = rows, breakdown_df.height
+                with EQR_Metrics.stage('spill', company=member) as record:
+                    EQR_Writer.write_spill(breakdown_df, path, compression)
+                    record['rows_out'], record['bytes_written'] = breakdown_df.height, os.path.getsize(path)
+            elif os.path.exists(path):
+                os.remove(path)
+            # Every Filing is committed on its own so an interrupted run keeps its progress
+            conn.execute('INSERT OR REPLACE INTO filings VALUES (?, ?, ?, ?, ?, ?)',
+                         (outer_zip, member, infos[member].CRC, infos[member].file_size, rows, datetime.datetime.now().isoformat()))
+            conn.commit()
+    finally:
+        conn.close()
+
+    # Merge the Filings into the per-Quarter output
+    with zipfile.ZipFile(outer_file) as zf_outer:
+        paths = [filing_path(cache_dir, outer_file, member) for member in zf_outer.namelist()]
+    paths = [path for path in paths if os.path.exists(path)]
+    if len(paths) > 0:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with EQR_Metrics.stage('write', file=os.path.basename(output_path)) as record:
+            EQR_Writer.merge_spill(paths, output_path, compression)
+            record['bytes_read'] = sum(os.path.getsize(path) for path in paths)
+            record['bytes_written'] = os.path.getsize(output_path)
+        # A CSV twin (write_csv) is rewritten with its Parquet File, so concat never appends stale rows
+        if os.path.exists(EQR_Writer.csv_twin(output_path)):
+            EQR_Writer.write_twin(paths, output_path)
+        return pl.scan_parquet(output_path).select(pl.len()).collect().item()
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    EQR_Writer.remove_twin(output_path)
+    return 0
@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import datetime
+import cProfile
+import contextlib
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+# JSON lines File every stage record is appended to, records are only printed when None
+METRICS_PATH = os.environ.get('EQR_METRICS_PATH')
+
+# Profile of every Quarter, e.g. 'profile_{outer_zip}.prof' ('.html' with pyinstrument), no profiling when None
+PROFILE_PATH = os.environ.get('EQR_PROFILE_PATH')
+PROFILER = os.environ.get('EQR_PROFILER', 'cprofile')  # or 'pyinstrument' if installed
+
+# Fields added to every record, e.g. the outer ZIP being processed, see scope
+context = {}
+
+# Pool Workers buffer their records in records and hand them back to the Parent with drain, see configure_worker
+worker = False
+records = []
+
+# Running totals of the stages of the current Company, see tally and emit_tallies
+company_tallies = {}
+
+
+# The environment is updated too so spawned Processes (Batches) record to the same File
+def configure(metrics_path=None, profile_path=None, profiler='cprofile'):
+    global METRICS_PATH, PROFILE_PATH, PROFILER
+    METRICS_PATH, PROFILE_PATH, PROFILER = metrics_path, profile_path, profiler
+    for name, value in [('EQR_METRICS_PATH', metrics_path), ('EQR_PROFILE_PATH', profile_path), ('EQR_PROFILER', profiler)]:
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+# Records of a pool Worker go back to the Parent, which writes and prints them
+def configure_worker():
+    global worker
+    configure()
+    worker = True
+
+
+# Peak resident Memory (in MB) of this Process, and of its finished Workers when the platform reports it
+def peak_memory():
+    process_peak, workers_peak = None, None
+    if resource is not None:
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        unit = 1 if sys.platform == 'darwin' else 1024
+        process_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20
+        workers_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20
+    elif psutil is not None:
+        process_peak = psutil.Process().memory_info().peak_wset / 2**20
+    return process_peak, workers_peak
+
+
+# Write a record (JSON line) and print the Quarter level ones, Company level records only go to the File
+def emit(record, echo=True):
+    record = dict(context, **record)
+    if worker:
+        records.append(record)
+        return
+    if METRICS_PATH is not None:
+        with open(METRICS_PATH, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+    if echo and 'company' not in record:
+        counts = ''.join(f', {record[key]:,} {key.replace("_", " ")}' for key in ['rows_in', 'rows_out', 'bytes_read', 'bytes_written'] if record.get(key) is not None)
+        name = record.get('file', record.get('outer_zip', record.get('source', '')))
+        memory = f", peak {record['peak_rss_mb']:.0f} MB" if record.get('peak_rss_mb') is not None else ''
+        print(f"{record['stage']} {name}: {record['wall_s']:.2f} s{counts}{memory}.")
+
+
+# Time a stage and emit its record: wall and CPU time, peak RSS and whatever the caller sets (rows_in, rows_out, bytes_read, bytes_written)
+# with EQR_Metrics.stage('write', file=name) as record:
+#     record['rows_out'] = df.height
+@contextlib.contextmanager
+def stage(name, **fields):
+    record = dict(stage=name, **fields)
+    record['started_at'] = datetime.datetime.now().isoformat()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 4)
+        record['cpu_s'] = round(time.process_time() - cpu, 4)
+        process_peak, workers_peak = peak_memory()
+        record['peak_rss_mb'] = process_peak
+        if workers_peak:
+            record['workers_peak_rss_mb'] = workers_peak
+        emit(record)
+
+
+# Add a stage to running totals (those of the current Company by default), several calls of the same stage add up
+@contextlib.contextmanager
+def tally(name, tallies=company_tallies):
+    totals = tallies.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0})
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield totals
+    finally:
+        totals['wall_s'] += time.perf_counter() - wall
+        totals['cpu_s'] += time.process_time() - cpu
+
+
+def count(totals, key, value):
+    totals[key] = totals.get(key, 0) + value
+
+
+# Time spent getting each item of an iterable (e.g. reading the next Company) goes to the name stage
+def tally_iter(iterable, name, tallies=company_tallies):
+    iterator = iter(iterable)
+    while True:
+        with tally(name, tallies):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+# One record per tallied stage, then start over (for the next Company)
+def emit_tallies(tallies=company_tallies, **fields):
+    process_peak = peak_memory()[0]
+    for name, totals in tallies.items():
+        totals['wall_s'], totals['cpu_s'] = round(totals['wall_s'], 4), round(totals['cpu_s'], 4)
+        emit(dict(stage=name, **fields, **totals, peak_rss_mb=process_peak))
+    tallies.clear()
+
+
+# Records emitted since the last call, so a Worker can return them with its results
+def drain():
+    drained = records[:]
+    records.clear()
+    return drained
+
+
+# Add fields (e.g. outer_zip) to every record emitted inside the block
+@contextlib.contextmanager
+def scope(**fields):
+    previous = dict(context)
+    context.update(fields)
+    try:
+        yield
+    finally:
+        context.clear()
+        context.update(previous)
+
+
+# Profile the block with cProfile (or pyinstrument) when PROFILE_PATH is set, the path can use the context fields
+@contextlib.contextmanager
+def profile():
+    if PROFILE_PATH is None:
+        yield
+        return
+    path = PROFILE_PATH.format(**context)
+    if PROFILER == 'pyinstrument':
+        import pyinstrument
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, 'w') as file:
+                file.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+
+# Roots of every input, temporary and output File, set through configure (or the EQR_CLI options) or the environment variables
+# Input: outer (Quarter) ZIPs CSV_<year>_Q<quarter>.zip
+DATA_DIRECTORY = os.environ.get('EQR_DATA_DIR', r'O:\POOL\PRIVATE\RISKMGMT\EQR Reporting\EQR Study\Data_Files')
+# Temporary: spill Files, one scratch directory per run, best on a fast local disk
+TEMP_DIRECTORY = os.environ.get('EQR_TEMP_DIR', r'c:\Users\LauC2\Temp')
+# Output: per-Quarter Files, one directory per Product and Granularity, e.g. energy_hourly
+OUTPUT_DIRECTORY = os.environ.get('EQR_OUTPUT_DIR', r'c:\Users\LauC2')
+# Study: final concatenated Files and Datasets
+STUDY_DIRECTORY = os.environ.get('EQR_STUDY_DIR', r'O:\POOL\PRIVATE\RISKMGMT\EQR Reporting\EQR Study')
+
+ENVIRONMENT = {
+    'DATA_DIRECTORY': 'EQR_DATA_DIR',
+    'TEMP_DIRECTORY': 'EQR_TEMP_DIR',
+    'OUTPUT_DIRECTORY': 'EQR_OUTPUT_DIR',
+    'STUDY_DIRECTORY': 'EQR_STUDY_DIR'
+}
+
+
+# Change the roots that are not None, the environment is updated too so spawned Processes (Workers, Batches) see the same roots
+def configure(data_directory=None, temp_directory=None, output_directory=None, study_directory=None):
+    values = {'DATA_DIRECTORY': data_directory, 'TEMP_DIRECTORY': temp_directory, 'OUTPUT_DIRECTORY': output_directory,
+              'STUDY_DIRECTORY': study_directory}
+    for name, value in values.items():
+        if value is not None:
+            globals()[name] = value
+            os.environ[ENVIRONMENT[name]] = value
+
+
+def outer_zip(year_quarter):
+    return os.path.join(DATA_DIRECTORY, 'CSV_' + year_quarter + '.zip')
+
+
+# Directory of the per-Quarter Files of a Product and Granularity, e.g. energy_hourly
+def output_dir(product, granularity):
+    return os.path.join(OUTPUT_DIRECTORY, f'{product}_{granularity}')
+
+
+# Scratch directory of one run, always a new one so runs on the same host never share spill Files
+def scratch_dir(name):
+    os.makedirs(TEMP_DIRECTORY, exist_ok=True)
+    return tempfile.mkdtemp(prefix=name + '_', dir=TEMP_DIRECTORY)
@@ -0,0 +1,321 @@
+import os
+import functools
+import polars as pl
+import EQR_Aggregate
+import EQR_Breakdown
+import EQR_Clean
+import EQR_Filter
+import EQR_Format
+import EQR_Manifest
+import EQR_Metrics
+import EQR_Paths
+import EQR_Reader
+import EQR_Writer
+
+
+# Granularity Sinks, each turns a chunk of filtered Transactions into its output rows
+# raw keeps the filtered Transactions as read, so they can be broken down later without reading the ZIPs again (see main_breakdown)
+def raw_sink(df):
+    return df
+
+
+def no_breakdown_sink(df):
+    return EQR_Format.add_utc_columns(EQR_Format.fix_data_format(df))
+
+
+def daily_sink(df):
+    return EQR_Breakdown.breakdown(df, 'daily')
+
+
+def hourly_sink(df):
+    return EQR_Breakdown.breakdown(df, 'hourly')
+
+
+# Only 5 and 15 minute Transactions are broken down to 15 minutes
+def fifteen_minute_sink(df):
+    return EQR_Breakdown.breakdown(df.filter(pl.col('increment_name').cast(pl.Utf8).is_in(['5', '15'])), '15min')
+
+
+# Sketch of the daily_by_hub aggregate, see EQR_Aggregate
+def daily_by_hub_sink(df):
+    return EQR_Aggregate.daily_by_hub_sketch(EQR_Format.fix_data_format(df))
+
+
+SINKS = {
+    'raw': raw_sink,
+    'no_breakdown': no_breakdown_sink,
+    'daily': daily_sink,
+    'hourly': hourly_sink,
+    '15min': fifteen_minute_sink,
+    'daily_by_hub': daily_by_hub_sink
+}
+
+# Outputs whose spill Files are partial aggregates, they are merged instead of appended and get no CSV File
+MERGES = {
+    'daily_by_hub': EQR_Aggregate.merge_sketch_files
+}
+
+
+# Same naming as the per-Granularity Scripts, e.g. energy_hourly\intermediate_energy_transactions_hourly_2024_Q1.parquet
+def output_path(product, granularity, year_quarter):
+    return os.path.join(EQR_Paths.output_dir(product, granularity), f'intermediate_{product}_transactions_{granularity}_{year_quarter}.parquet')
+
+
+# Create temporary Directory
+def create_temp_dir(temp_dir):
+    if not os.path.exists(temp_dir):
+        os.makedirs(temp_dir)
+
+
+# Clean up intermediate, temporary Files and Directory
+def remove_temp(intermediate_files, temp_dir):
+    for file in intermediate_files:
+        os.remove(file)
+    if os.path.exists(temp_dir):
+        os.rmdir(temp_dir)
+
+
+# Spill one DataFrame of a Granularity (or of its quarantine output) to a new File in temp_dir
+def spill(df, granularity, temp_dir, intermediate_files, compression, tallies):
+    intermediate_file = os.path.join(temp_dir, f'intermediate_{granularity}_chunk_{len(intermediate_files[granularity])}.parquet')
+    with EQR_Metrics.tally('spill', tallies) as totals:
+        EQR_Writer.write_spill(df, intermediate_file, compression)
+        EQR_Metrics.count(totals, 'rows_out', df.height)
+        EQR_Metrics.count(totals, 'bytes_written', os.path.getsize(intermediate_file))
+    intermediate_files[granularity].append(intermediate_file)
+
+
+# Break filtered rows down to every Granularity in outputs ({granularity: output path}), one spill File per chunk and Granularity in temp_dir
+# rules are the breakdown stage cleaning Rules (see EQR_Clean), they see the output rows of every Granularity but raw,
+# Sketches (MERGES) are built from the rows passing them. Rows they reject go to the quarantine output of the Granularity when outputs has one
+# Time and rows of the breakdown, clean_<granularity> and spill stages add up in tallies
+def spill_chunks(df, schema, outputs, temp_dir, intermediate_files, compression=EQR_Writer.COMPRESSION, chunk_size=10000, tallies=None,
+                 rules=None):
+    tallies = {} if tallies is None else tallies
+    for chunk in df.iter_slices(chunk_size):
+        chunk_df = pl.DataFrame(chunk, schema=schema)
+        for granularity in outputs:
+            if granularity not in SINKS:
+                continue  # quarantine outputs get the rows rejected while cleaning their Granularity
+            sink_df, rejected = chunk_df, None
+            if rules and granularity in MERGES:
+                with EQR_Metrics.tally('clean_' + granularity, tallies) as totals:
+                    sink_df, rejected = EQR_Clean.clean(sink_df, rules, totals)
+            with EQR_Metrics.tally('breakdown', tallies) as totals:
+                sink_df = SINKS[granularity](sink_df)
+                EQR_Metrics.count(totals, 'rows_in', chunk_df.height)
+                EQR_Metrics.count(totals, 'rows_out', sink_df.height)
+            if rules and granularity not in MERGES and granularity != 'raw':
+                with EQR_Metrics.tally('clean_' + granularity, tallies) as totals:
+                    sink_df, rejected = EQR_Clean.clean(sink_df, rules, totals)
+            spill(sink_df, granularity, temp_dir, intermediate_files, compression, tallies)
+            if rejected is not None and rejected.height > 0 and quarantine_key(granularity) in outputs:
+                spill(rejected, quarantine_key(granularity), temp_dir, intermediate_files, compression, tallies)
+
+
+# Merge the spill Files of every Granularity into its output with the streaming engine, CSV only if asked for
+def merge_outputs(intermediate_files, outputs, compression=EQR_Writer.COMPRESSION, write_csv=False):
+    for granularity, final_output_path in outputs.items():
+        if len(intermediate_files[granularity]) == 0:
+            continue
+        os.makedirs(os.path.dirname(final_output_path), exist_ok=True)
+        with EQR_Metrics.stage('write', file=os.path.basename(final_output_path), granularity=granularity) as record:
+            MERGES.get(granularity, EQR_Writer.merge_spill)(intermediate_files[granularity], final_output_path, compression)
+            record['bytes_read'] = sum(os.path.getsize(file) for file in intermediate_files[granularity])
+            record['bytes_written'] = os.path.getsize(final_output_path)
+        if write_csv and granularity not in MERGES:
+            csv_path = EQR_Writer.csv_twin(final_output_path)
+            with EQR_Metrics.stage('write', file=os.path.basename(csv_path), granularity=granularity) as record:
+                EQR_Writer.write_twin(intermediate_files[granularity], final_output_path)
+                record['bytes_written'] = os.path.getsize(csv_path)
+
+
+# Quarantine output of a key, it keeps the rows rejected by the filed stage cleaning Rules of the key as read
+# Quarantine output of a Granularity, it keeps the output rows rejected by the breakdown stage Rules
+def quarantine_key(key):
+    return key + '_quarantine'
+
+
+# Apply the filed stage cleaning Rules of every routed DataFrame (cleaning: {key: rules}, see EQR_Clean), all Rules of a key in one pass
+# Rejected rows go to the quarantine output of the key when outputs has one, rejections per Rule add up in tallies
+def clean_routed(routed, cleaning, outputs, tallies):
+    cleaned = {}
+    for key, df_key in routed.items():
+        rules = EQR_Clean.stage_rules(cleaning.get(key, {}), 'filed')
+        if len(rules) == 0:
+            cleaned[key] = df_key
+            continue
+        with EQR_Metrics.tally('clean', tallies) as totals:
+            cleaned[key], rejected = EQR_Clean.clean(df_key, rules, totals)
+        if quarantine_key(key) in outputs:
+            cleaned[quarantine_key(key)] = rejected
+    return cleaned
+
+
+# Stream DataFrames through the Breakdown: they are routed (route_function: DataFrame -> {key: DataFrame}),
+# buffered up to chunk_size rows and spilled as they come, then every output is merged from its spill Files
+# Memory stays bounded by a few DataFrames and chunks however large the Quarter is (outputs: {key: {granularity: output path}}, temp_dirs: {key: directory})
+# With cleaning ({key: rules}) the filed stage Rules clean the routed rows (see clean_routed), the breakdown stage Rules the output rows (see spill_chunks)
+# Returns the rows routed to each key, stages (read, filter, clean, concat, breakdown, spill, write) are recorded by EQR_Metrics
+def stream_frames(frames, schema, route_function, outputs, temp_dirs, compression=EQR_Writer.COMPRESSION, write_csv=False, chunk_size=10000,
+                  cleaning=None):
+    for temp_dir in temp_dirs.values():
+        create_temp_dir(temp_dir)
+    intermediate_files = {key: {granularity: [] for granularity in outputs[key]} for key in outputs}
+    breakdown_rules = {key: EQR_Clean.stage_rules(rules, 'breakdown') for key, rules in (cleaning or {}).items()}
+    pending = {key: [] for key in outputs}
+    rows = {key: 0 for key in outputs}
+    tallies = {}
+    try:
+        for df in EQR_Metrics.tally_iter(frames, 'read', tallies):
+            EQR_Metrics.count(tallies['read'], 'rows_out', df.height)
+            with EQR_Metrics.tally('filter', tallies) as totals:
+                routed = route_function(df)
+                EQR_Metrics.count(totals, 'rows_in', df.height)
+                EQR_Metrics.count(totals, 'rows_out', sum(df_key.height for df_key in routed.values()))
+            if cleaning is not None:
+                routed = clean_routed(routed, cleaning, outputs, tallies)
+            for key, df_key in routed.items():
+                if df_key.height == 0:
+                    continue
+                rows[key] += df_key.height
+                pending[key].append(df_key)
+                if sum(df_pending.height for df_pending in pending[key]) >= chunk_size:
+                    # Spill whole chunks only, the rest waits for the next DataFrame
+                    with EQR_Metrics.tally('concat', tallies):
+                        df_pending = pl.concat(pending[key])
+                    full = df_pending.height - df_pending.height % chunk_size
+                    spill_chunks(df_pending.slice(0, full), schema, outputs[key], temp_dirs[key], intermediate_files[key], compression, chunk_size, tallies,
+                                 breakdown_rules.get(key))
+                    pending[key] = [df_pending.slice(full)]
+        for key in outputs:
+            if len(pending[key]) > 0:
+                spill_chunks(pl.concat(pending[key]), schema, outputs[key], temp_dirs[key], intermediate_files[key], compression, chunk_size, tallies,
+                             breakdown_rules.get(key))
+        EQR_Metrics.emit_tallies(tallies)
+
+        for key in outputs:
+            merge_outputs(intermediate_files[key], outputs[key], compression, write_csv)
+    finally:
+        for key in outputs:
+            remove_temp([file for files in intermediate_files[key].values() for file in files], temp_dirs[key])
+    return rows
+
+
+# Stream an outer (Quarter) ZIP through the Breakdown, Companies are filtered as they are read, see stream_frames
+def stream_quarter(outer_file, schema, filter_function, route_function, outputs, temp_dirs, workers=1,
+                   compression=EQR_Writer.COMPRESSION, write_csv=False, chunk_size=10000, cleaning=None):
+    print('Start processing ', os.path.basename(outer_file), '.', sep='')
+    with EQR_Metrics.scope(outer_zip=os.path.basename(outer_file)), EQR_Metrics.profile(), EQR_Metrics.stage('quarter') as quarter_record:
+        frames = EQR_Reader.iter_outer_zip(outer_file, schema, filter_function, workers)
+        rows = stream_frames(frames, schema, route_function, outputs, temp_dirs, compression, write_csv, chunk_size, cleaning)
+        quarter_record['rows_out'] = sum(rows.values())
+        if len(outputs) > 1:
+            quarter_record['rows_by_output'] = rows
+
+
+# Read and filter an outer (Quarter) ZIP once, then write every Granularity in outputs ({granularity: output path}) from the same rows
+def run_quarter(outer_file, schema, filter_function, outputs, temp_dir, workers=1, compression=EQR_Writer.COMPRESSION,
+                write_csv=False, chunk_size=10000):
+    stream_quarter(outer_file, schema, filter_function, lambda df: {'rows': df}, {'rows': outputs}, {'rows': temp_dir},
+                   workers, compression, write_csv, chunk_size)
+
+
+# Read an outer (Quarter) ZIP once for several Products: rows matching any Product are kept while reading,
+# then routed to each Product (rules: {product: rule} of EQR_Filter.PRODUCTS, outputs: {product: {granularity: output path}})
+# Every output (Product or quarantine) gets its own temporary directory under temp_dir, cleaning: {product: rules}, see EQR_Clean
+def run_products(outer_file, schema, rules, outputs, temp_dir, workers=1, compression=EQR_Writer.COMPRESSION,
+                 write_csv=False, chunk_size=10000, cleaning=None):
+    filter_function = functools.partial(EQR_Filter.filter_products, rules)  # partial of a module function so workers can unpickle it
+    stream_quarter(outer_file, schema, filter_function, lambda df: EQR_Filter.route(df, rules), outputs,
+                   {key: os.path.join(temp_dir, key) for key in outputs}, workers, compression, write_csv, chunk_size, cleaning)
+    if os.path.exists(temp_dir):
+        os.rmdir(temp_dir)
+
+
+# Quarantine outputs of a Product for the stages its cleaning Rules use, Sketches (MERGES) and raw get none
+def add_quarantine(outputs, product, rules, year_quarter):
+    if len(EQR_Clean.stage_rules(rules, 'filed')) > 0:
+        outputs[quarantine_key(product)] = {'raw': output_path(product, 'quarantine', year_quarter)}
+    if len(EQR_Clean.stage_rules(rules, 'breakdown')) > 0:
+        for granularity in list(outputs[product]):
+            if granularity not in MERGES and granularity != 'raw':
+                outputs[product][quarantine_key(granularity)] = output_path(product, quarantine_key(granularity), year_quarter)
+
+
+# Build every requested Granularity of every requested Product for a Quarter with a single decompression and parse
+# Extra Products (e.g. SPINNING RESERVE or other Hubs) can be registered from a TOML File, see EQR_Filter.load_products
+# Include 'raw' in granularities to keep the filtered Transactions for main_breakdown
+# cleaning names a Rule Set or TOML File of cleaning Rules (see EQR_Clean.load_cleaning), every Granularity is built from the clean rows
+# With quarantine the rows rejected by the filed stage Rules are kept as read, e.g. energy_quarantine\intermediate_energy_transactions_quarantine_2024_Q1.parquet,
+# and the rows rejected by the breakdown stage Rules next to their Granularity, e.g. energy_hourly_quarantine\intermediate_energy_transactions_hourly_quarantine_2024_Q1.parquet
+def main(year_quarter, products=('energy', 'ancillary'), granularities=('no_breakdown', 'daily', 'hourly', '15min'), workers=1,
+         compression=EQR_Writer.COMPRESSION, write_csv=False, products_config=None, cleaning=None, quarantine=False):
+    if products_config is not None:
+        EQR_Filter.load_products(products_config)
+    if isinstance(products, str):
+        products = (products,)
+    with pl.StringCache():
+        rules = {product: EQR_Filter.PRODUCTS[product] for product in products}
+        outputs = {product: {granularity: output_path(product, granularity, year_quarter) for granularity in granularities}
+                   for product in products}
+        if cleaning is not None:
+            cleaning = {product: product_rules for product, product_rules in EQR_Clean.load_cleaning(cleaning).items() if product in rules}
+            if quarantine:
+                for product in cleaning:
+                    add_quarantine(outputs, product, cleaning[product], year_quarter)
+        # A new scratch directory per run so runs can overlap
+        temp_dir = EQR_Paths.scratch_dir('products_' + year_quarter)
+        run_products(EQR_Paths.outer_zip(year_quarter), EQR_Format.DATATYPES, rules, outputs, temp_dir, workers, compression, write_csv,
+                     cleaning=cleaning)
+
+
+# Break the raw output of main (filtered Transactions) down to other Granularities, the ZIPs are not read again
+# workers is not used, the raw Files are already filtered
+def main_breakdown(year_quarter, products=('energy', 'ancillary'), granularities=('daily', 'hourly', '15min'), workers=1,
+                   compression=EQR_Writer.COMPRESSION, write_csv=False, chunk_size=10000, cleaning=None, quarantine=False):
+    if isinstance(products, str):
+        products = (products,)
+    # The raw Files were cleaned by the filed stage Rules while ingesting, only the breakdown stage Rules are left
+    cleaning = {} if cleaning is None else {product: EQR_Clean.stage_rules(rules, 'breakdown') for product, rules in EQR_Clean.load_cleaning(cleaning).items()}
+    with pl.StringCache():
+        for product in products:
+            raw_path = output_path(product, 'raw', year_quarter)
+            if not os.path.exists(raw_path):
+                print(f'No raw File for {product} {year_quarter}, run main with the raw Granularity first.')
+                continue
+            outputs = {product: {granularity: output_path(product, granularity, year_quarter) for granularity in granularities}}
+            if quarantine and product in cleaning:
+                add_quarantine(outputs, product, cleaning[product], year_quarter)
+            temp_dir = EQR_Paths.scratch_dir(product + '_' + year_quarter)
+            with EQR_Metrics.scope(source=os.path.basename(raw_path)), EQR_Metrics.profile(), EQR_Metrics.stage('quarter') as quarter_record:
+                rows = stream_frames(EQR_Writer.iter_spill(raw_path, chunk_size), EQR_Format.DATATYPES, lambda df: {product: df},
+                                     outputs, {product: temp_dir}, compression, write_csv, chunk_size, cleaning)
+                quarter_record['rows_out'] = rows[product]
+
+
+# Filing cache and Manifest of a Product and Granularity, same naming as the per-Granularity Scripts, e.g. energy_hourly_filings
+def filings_dir(product, granularity):
+    return os.path.join(EQR_Paths.OUTPUT_DIRECTORY, f'{product}_{granularity}_filings')
+
+
+# Rerun of a Quarter that only reprocesses new or refiled Company ZIPs, see EQR_Manifest
+# Every Product and Granularity keeps its own Filing cache, so each one reads the changed Companies of the outer ZIP
+# daily_by_hub Sketches are merged, not rebuilt from Filings, use main for them
+def main_incremental(year_quarter, products=('energy', 'ancillary'), granularities=('no_breakdown', 'daily', 'hourly', '15min'), workers=1,
+                     compression=EQR_Writer.COMPRESSION, products_config=None):
+    if products_config is not None:
+        EQR_Filter.load_products(products_config)
+    if isinstance(products, str):
+        products = (products,)
+    with pl.StringCache():
+        print('Start updating CSV_', year_quarter, '.zip.', sep='')
+        for product in products:
+            filter_function = functools.partial(EQR_Filter.filter_products, {product: EQR_Filter.PRODUCTS[product]})
+            for granularity in granularities:
+                if granularity in MERGES:
+                    print(f'Skip {granularity}, its Sketches can not be updated by Filing.')
+                    continue
+                with EQR_Metrics.scope(product=product, granularity=granularity):
+                    EQR_Manifest.update_quarter(EQR_Paths.outer_zip(year_quarter), EQR_Format.DATATYPES, filter_function, SINKS[granularity],
+                                                filings_dir(product, granularity), output_path(product, granularity, year_quarter), workers, compression)
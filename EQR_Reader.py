@@ -0,0 +1,168 @@
+import zipfile
+import io
+import collections
+import concurrent.futures
+import multiprocessing
+import polars as pl
+import EQR_Metrics
+
+
+# Size of the raw CSV blocks handed to Polars, peak Memory is a few of these instead of whole Company Files
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+# Split a CSV Stream into blocks of whole Records
+# A block only ends on a Newline outside of quotes, so quoted Fields containing Newlines are never cut in half
+def csv_chunks(source, chunk_size=CHUNK_SIZE):
+    leftover = b''
+    while True:
+        with EQR_Metrics.tally('unzip') as totals:
+            data = source.read(chunk_size)
+            EQR_Metrics.count(totals, 'bytes_read', len(data))
+        if not data:
+            break
+        block = leftover + data
+        end = block.rfind(b'\n')
+        while end != -1 and block.count(b'"', 0, end) % 2 == 1:
+            end = block.rfind(b'\n', 0, end)
+        if end == -1:
+            leftover = block
+            continue
+        leftover = block[end + 1:]
+        yield block[:end + 1]
+    if leftover.strip():
+        yield leftover
+
+
+# EQR Files are ISO-8859-1, only blocks with non-ASCII bytes need to be transcoded before Polars reads them as UTF-8
+def to_utf8(block):
+    if block.isascii():
+        return block
+    return block.decode('ISO-8859-1').encode('utf8')
+
+
+# Columns the filters look at, only these are parsed for every row of a block
+FILTER_COLUMNS = ['point_of_delivery_specific_location', 'point_of_delivery_balancing_authority', 'product_name']
+
+
+# Parse a block in two passes: first only FILTER_COLUMNS to find the matching rows,
+# then every column but only for the matching records, so non-matching rows are never fully parsed
+def read_block(block, has_header, schema, filter_function):
+    columns = [i for i, column in enumerate(schema) if column in FILTER_COLUMNS]
+    with EQR_Metrics.tally('parse') as totals:
+        df = pl.read_csv(block, has_header=has_header, schema=schema, columns=columns, null_values='', encoding='utf8')
+        EQR_Metrics.count(totals, 'rows_in', df.height)
+    with EQR_Metrics.tally('filter') as totals:
+        selected = filter_function(df.with_row_index('_line'))['_line']
+        EQR_Metrics.count(totals, 'rows_in', df.height)
+        EQR_Metrics.count(totals, 'rows_out', selected.len())
+    if selected.len() == 0:
+        return pl.DataFrame(schema=schema)
+    lines = block.split(b'\n')
+    if has_header:
+        lines = lines[1:]
+    if not lines[-1].strip():
+        lines = lines[:-1]
+    # Records spread over several lines (quoted Newlines) or skipped lines, fall back to parsing the whole block
+    with EQR_Metrics.tally('parse'):
+        if len(lines) != df.height or selected.len() == df.height:
+            return filter_function(pl.read_csv(block, has_header=has_header, schema=schema, null_values='', encoding='utf8'))
+        records = b'\n'.join([lines[i] for i in selected]) + b'\n'
+        return pl.read_csv(records, has_header=False, schema=schema, null_values='', encoding='utf8')
+
+
+# Read one transactions.csv block by block and keep only the rows selected by filter_function
+def read_transactions(source, schema, filter_function, chunk_size=CHUNK_SIZE):
+    df_list = []
+    for i, block in enumerate(csv_chunks(source, chunk_size)):
+        df_list.append(read_block(to_utf8(block), i == 0, schema, filter_function))
+    if len(df_list) == 0:
+        return pl.DataFrame(schema=schema)
+    return pl.concat(df_list)
+
+
+# Read every Company transactions.csv inside one inner (Company) ZIP
+def read_inner_zip(zf_outer, inner_name, schema, filter_function):
+    df_list = []
+    with zf_outer.open(inner_name) as inner_file:
+        if zipfile.is_zipfile(inner_file):
+            with zipfile.ZipFile(inner_file) as zf_inner:
+                # Read the second Layer of the Zipfile (by Company)
+                for csvfile in zf_inner.namelist():
+                    if csvfile.lower().endswith('transactions.csv'):
+                        with zf_inner.open(csvfile) as source:
+                            df_list.append(read_transactions(source, schema, filter_function))
+    # One record per stage (unzip, parse, filter) of the Company
+    EQR_Metrics.emit_tallies(company=inner_name, rows=sum(df.height for df in df_list))
+    return df_list
+
+
+# Each Worker opens the outer ZIP once and keeps it for all the Companies it is handed
+worker_zip = None
+
+
+def init_worker(outer_file):
+    global worker_zip
+    worker_zip = zipfile.ZipFile(outer_file)
+    EQR_Metrics.configure_worker()  # Records go back to the Parent, see from_worker
+
+
+# Runs in a Worker, DataFrames go back to the Parent as Arrow IPC buffers together with the stage records of the Company
+def process_inner_zip(inner_name, schema, filter_function):
+    buffers = []
+    for df in read_inner_zip(worker_zip, inner_name, schema, filter_function):
+        buffer = io.BytesIO()
+        df.write_ipc(buffer)
+        buffers.append(buffer.getvalue())
+    return buffers, EQR_Metrics.drain()
+
+
+# Back in the Parent: emit the Worker records and rebuild the DataFrames
+def from_worker(result):
+    buffers, records = result
+    for record in records:
+        EQR_Metrics.emit(record)
+    return [pl.read_ipc(buffer) for buffer in buffers]
+
+
+# Read the given inner ZIPs (all of them if members is None) of an outer (Quarter) ZIP File, optionally handing the Companies out to a pool of Workers
+# Yields (inner_name, df_list) pairs, always in the order of the outer ZIP whatever the number of Workers
+# At most two Companies per Worker are in flight, so Memory stays bounded however many Companies the Quarter holds
+def iter_members(outer_file, schema, filter_function, members=None, workers=1):
+    if not zipfile.is_zipfile(outer_file):  # Only considers Zipfiles
+        return
+    with zipfile.ZipFile(outer_file) as zf_outer:
+        # Read the first Layer of the Zipfile (by Quarter)
+        inner_names = [name for name in zf_outer.namelist() if members is None or name in members]
+        if workers <= 1:
+            for inner_name in inner_names:
+                yield inner_name, read_inner_zip(zf_outer, inner_name, schema, filter_function)
+            return
+    # Polars is not fork-safe, Workers are always spawned
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=init_worker, initargs=(outer_file,)) as executor:
+        pending = collections.deque()
+        for inner_name in inner_names:
+            pending.append((inner_name, executor.submit(process_inner_zip, inner_name, schema, filter_function)))
+            if len(pending) >= workers * 2:
+                inner_name, future = pending.popleft()
+                yield inner_name, from_worker(future.result())
+        while pending:
+            inner_name, future = pending.popleft()
+            yield inner_name, from_worker(future.result())
+
+
+# Same as iter_members, as a list
+def process_members(outer_file, schema, filter_function, members=None, workers=1):
+    return list(iter_members(outer_file, schema, filter_function, members, workers))
+
+
+# Process each outer (Quarter) ZIP File, returns the filtered DataFrames of every Company
+def process_outer_zip(outer_file, schema, filter_function, workers=1):
+    return list(iter_outer_zip(outer_file, schema, filter_function, workers))
+
+
+# Same as process_outer_zip, one filtered DataFrame at a time
+def iter_outer_zip(outer_file, schema, filter_function, workers=1):
+    for inner_name, df_list in iter_members(outer_file, schema, filter_function, None, workers):
+        yield from df_list
@@ -0,0 +1,150 @@
+import io
+import os
+import datetime
+import zipfile
+import numpy as np
+import polars as pl
+import EQR_Format
+
+
+# Share of Transactions per Delivery Point, Hub and Product, used when no mix is given
+HUBS = {
+    'Mid-Columbia (Mid-C)': 0.35,
+    'COB': 0.2,
+    'Palo Verde': 0.2,
+    'SP15': 0.15,
+    'NP15': 0.1
+}
+
+PRODUCTS = {
+    'ENERGY': 0.8,
+    'CAPACITY': 0.08,
+    'REGULATION & FREQUENCY RESPONSE': 0.04,
+    'PRIMARY FREQUENCY RESPONSE': 0.03,
+    'SPINNING RESERVE': 0.05
+}
+
+PEAKING = {
+    'P': 0.4,
+    'OP': 0.3,
+    'FP': 0.25,
+    None: 0.05
+}
+
+# Increments of short-term Transactions and their length in minutes (from, to)
+SHORT_TERM_INCREMENTS = {
+    '5': (5, 60),
+    '15': (15, 240),
+    'H': (60, 24 * 60),
+    'D': (24 * 60, 7 * 24 * 60)
+}
+
+# Long-term Transactions last from a week to a Quarter
+LONG_TERM_MINUTES = (7 * 24 * 60, 92 * 24 * 60)
+
+
+# First minute of a Quarter, e.g. quarter_start('2024_Q1') -> 2024-01-01 00:00
+def quarter_start(year_quarter):
+    return datetime.datetime(int(year_quarter[:4]), 3 * int(year_quarter[-1]) - 2, 1)
+
+
+def quarter_minutes(year_quarter):
+    start = quarter_start(year_quarter)
+    if year_quarter[-1] == '4':
+        end = datetime.datetime(start.year + 1, 1, 1)
+    else:
+        end = datetime.datetime(start.year, start.month + 3, 1)
+    return int((end - start).total_seconds() // 60)
+
+
+def choice(rng, mix, size):
+    keys = list(mix)
+    weights = np.array([mix[key] for key in keys], dtype=float)
+    return [keys[i] for i in rng.choice(len(keys), size=size, p=weights / weights.sum())]
+
+
+# Transactions of one Company, as found in a transactions.csv File (Datetimes as %Y%m%d%H%M text)
+def make_transactions(rows, year_quarter, seed=0, company='Company 0', hubs=HUBS, products=PRODUCTS, peaking=PEAKING,
+                      long_term_share=0.03):
+    rng = np.random.default_rng(seed)
+    start = quarter_start(year_quarter)
+
+    # Most Transactions start on the hour, the rest on any minute of the Quarter
+    begin_minutes = rng.integers(0, quarter_minutes(year_quarter), rows)
+    begin_minutes = np.where(rng.random(rows) < 0.8, begin_minutes - begin_minutes % 60, begin_minutes)
+
+    long_term = rng.random(rows) < long_term_share
+    increments = np.array(choice(rng, {increment: 1 for increment in SHORT_TERM_INCREMENTS}, rows), dtype=object)
+    lengths = np.empty(rows, dtype=np.int64)
+    for increment, (low, high) in SHORT_TERM_INCREMENTS.items():
+        selected = increments == increment
+        step = low
+        lengths[selected] = rng.integers(1, high // step + 1, selected.sum()) * step
+    lengths[long_term] = rng.integers(LONG_TERM_MINUTES[0] // 1440, LONG_TERM_MINUTES[1] // 1440 + 1, long_term.sum()) * 1440
+    increments[long_term] = np.array(choice(rng, {'M': 0.7, 'D': 0.3}, long_term.sum()), dtype=object)
+
+    quantity = np.round(rng.lognormal(3.5, 1.2, rows), 2)
+    price = np.round(np.clip(rng.normal(40, 25, rows), -20, 2000), 2)
+    price[rng.random(rows) < 0.02] = 0
+    standardized_quantity = np.where(rng.random(rows) < 0.2, None, quantity.astype(str))
+    standardized_price = np.where(rng.random(rows) < 0.2, None, price.astype(str))
+    transmission_charge = np.where(rng.random(rows) < 0.9, 0.0, np.round(rng.uniform(0, 500, rows), 2))
+
+    df = pl.DataFrame({
+        'transaction_unique_id': [f'T{seed}_{i}' for i in range(rows)],
+        'seller_company_name': [company] * rows,
+        'customer_company_name': choice(rng, {f'Customer {i}': 1 for i in range(20)}, rows),
+        'ferc_tariff_reference': ['Market Based Rate Tariff'] * rows,
+        'contract_service_agreement': [f'CSA-{i % 50}' for i in range(rows)],
+        'transaction_unique_identifier': [f'U{seed}_{i}' for i in range(rows)],
+        'begin_minute': begin_minutes,
+        'length': lengths,
+        'trade_date': [int(start.strftime('%Y%m%d'))] * rows,
+        'exchange_brokerage_service': choice(rng, {None: 0.9, 'ICE': 0.1}, rows),
+        'type_of_rate': choice(rng, {'Fixed': 0.9, 'Formula': 0.1}, rows),
+        'time_zone': choice(rng, {'PP': 0.7, 'MP': 0.2, 'PD': 0.1}, rows),
+        'point_of_delivery_balancing_authority': choice(rng, {'HUB': 0.9, 'BPAT': 0.05, 'CISO': 0.05}, rows),
+        'point_of_delivery_specific_location': choice(rng, hubs, rows),
+        'class_name': choice(rng, {'F': 0.9, 'UP': 0.1}, rows),
+        'term_name': np.where(long_term, 'LT', 'ST'),
+        'increment_name': increments.tolist(),
+        'increment_peaking_name': choice(rng, peaking, rows),
+        'product_name': choice(rng, products, rows),
+        'transaction_quantity': quantity,
+        'price': price,
+        'rate_units': choice(rng, {'$/MWH': 0.95, '$/KW-MO': 0.05}, rows),
+        'standardized_quantity': standardized_quantity.tolist(),
+        'standardized_price': standardized_price.tolist(),
+        'total_transmission_charge': transmission_charge,
+    })
+    begin = pl.lit(start) + pl.duration(minutes=pl.col('begin_minute'))
+    return df.with_columns([
+        begin.dt.strftime('%Y%m%d%H%M').alias('transaction_begin_date'),
+        (begin + pl.duration(minutes=pl.col('length'))).dt.strftime('%Y%m%d%H%M').alias('transaction_end_date'),
+        (pl.col('transaction_quantity') * pl.col('price') + pl.col('total_transmission_charge')).round(2).cast(pl.Utf8).alias('total_transaction_charge')
+    ]).select(list(EQR_Format.DATATYPES))
+
+
+# Build an outer (Quarter) ZIP like the FERC ones: one inner ZIP per Company holding its contracts.csv and transactions.csv
+# Returns the path of the outer ZIP and the number of Transactions written
+def make_quarter(directory, year_quarter, companies=50, rows_per_company=10000, seed=0, hubs=HUBS, products=PRODUCTS,
+                 peaking=PEAKING, long_term_share=0.03):
+    os.makedirs(directory, exist_ok=True)
+    outer_file = os.path.join(directory, 'CSV_' + year_quarter + '.zip')
+    rng = np.random.default_rng(seed)
+    total_rows = 0
+    with zipfile.ZipFile(outer_file, 'w') as zf_outer:
+        for i in range(companies):
+            company_id = f'C{i:06d}'
+            # Company sizes vary around rows_per_company, a few large Filers and many small ones
+            rows = max(1, int(rows_per_company * rng.pareto(3) * 2)) if companies > 1 else rows_per_company
+            # Some Filers use accented names, transactions.csv Files are ISO-8859-1
+            company = f'Énergie {i} Inc' if i % 10 == 3 else f'Power Company {i} LLC'
+            df = make_transactions(rows, year_quarter, seed * 100003 + i, company, hubs, products, peaking, long_term_share)
+            inner = io.BytesIO()
+            with zipfile.ZipFile(inner, 'w', zipfile.ZIP_DEFLATED) as zf_inner:
+                zf_inner.writestr(f'{company_id}_{year_quarter}_contracts.csv', 'contract_unique_id,seller_company_name\n')
+                zf_inner.writestr(f'{company_id}_{year_quarter}_transactions.csv', df.write_csv(null_value='').encode('ISO-8859-1'))
+            zf_outer.writestr(f'{company_id}_{year_quarter}.zip', inner.getvalue())
+            total_rows += rows
+    return outer_file, total_rows
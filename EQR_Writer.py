@@ -0,0 +1,435 @@
+import os
+import re
+import json
+import datetime
+import shutil
+import collections
+import concurrent.futures
+import urllib.parse
+import polars as pl
+import EQR_Format
+import EQR_Metrics
+
+
+# Parquet codec for intermediate and per-Quarter Files: 'zstd', 'lz4', 'snappy', 'gzip' or 'uncompressed'
+COMPRESSION = 'zstd'
+
+# Rows per Parquet row group in the final Datasets, each row group carries its own min/max statistics
+ROW_GROUP_SIZE = 128 * 1024
+
+
+# Write a DataFrame to a binary spill File, Categorical columns keep their dictionaries
+def write_spill(df, path, compression=COMPRESSION):
+    df.write_parquet(path, compression=compression)
+
+
+# Read spill Files back in the order given, no CSV parsing involved
+def read_spill(paths):
+    return pl.concat([pl.read_parquet(path) for path in paths])
+
+
+# Directory name of one hive partition, values are percent-encoded so any Hub name is a valid path
+def partition_name(key, value):
+    return key + '=' + urllib.parse.quote(str(value), safe='')
+
+
+# Write one Quarter into a hive-partitioned Dataset: dataset_dir/year=2020/quarter=1/hub=COB/part-0.parquet
+# Rows are sorted by seller and begin date so the row-group statistics on seller_company_name, transaction_begin_date and price prune well
+def write_dataset(df, dataset_dir, year_quarter, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE):
+    quarter_dir = os.path.join(dataset_dir, partition_name('year', year_quarter[:4]), partition_name('quarter', year_quarter[-1]))
+    # Rewriting a Quarter replaces it
+    if os.path.exists(quarter_dir):
+        shutil.rmtree(quarter_dir)
+    df = df.with_columns(pl.col('point_of_delivery_specific_location').str.to_uppercase().fill_null('UNKNOWN').alias('hub'))
+    indexes = []
+    for hub, hub_df in df.group_by('hub', maintain_order=True):
+        hub_dir = os.path.join(quarter_dir, partition_name('hub', hub[0]))
+        os.makedirs(hub_dir)
+        hub_df = hub_df.drop('hub').sort(['seller_company_name', 'transaction_begin_date'], maintain_order=True)
+        hub_df.write_parquet(os.path.join(hub_dir, 'part-0.parquet'), compression=compression, statistics=True, row_group_size=row_group_size)
+        indexes.append(slice_index(hub_df, hub[0], os.path.relpath(os.path.join(hub_dir, 'part-0.parquet'), dataset_dir)))
+    os.makedirs(slice_index_dir(dataset_dir), exist_ok=True)
+    index_file = os.path.join(slice_index_dir(dataset_dir), year_quarter + '.parquet')
+    if len(indexes) > 0:
+        pl.concat(indexes).write_parquet(index_file)
+    elif os.path.exists(index_file):
+        os.remove(index_file)
+
+
+# Slice index of a Dataset, one File per Quarter next to the Dataset (inside it, a hive scan would take it for data)
+def slice_index_dir(dataset_dir):
+    return dataset_dir.rstrip('/\\') + '.index'
+
+
+# Year-month of the transaction_begin_date, e.g. '2022-07', whether the column is a Datetime or a '%Y/%m/%d %H:%M' string
+def month_expression(dtype):
+    if dtype == pl.Utf8:
+        return pl.col('transaction_begin_date').str.slice(0, 7).str.replace('/', '-')
+    return pl.col('transaction_begin_date').dt.strftime('%Y-%m')
+
+
+# Row range of every (seller, year-month) of one Dataset File, the File is sorted by seller and begin date so each is one contiguous run
+def slice_index(df, hub, file):
+    return (df.select(pl.col('seller_company_name').alias('seller'), month_expression(df.schema['transaction_begin_date']).alias('month'))
+              .with_row_index('first_row')
+              .group_by(['seller', 'month'], maintain_order=True)
+              .agg(pl.col('first_row').min(), pl.len().alias('rows'))
+              .select(pl.lit(hub).alias('hub'), 'month', 'seller', pl.lit(file).alias('file'),
+                      pl.col('first_row').cast(pl.UInt64), pl.col('rows').cast(pl.UInt64)))
+
+
+# Write every per-Quarter Parquet File of a Directory into one partitioned Dataset
+def write_quarter_dataset(directory, dataset_dir, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE):
+    for year_quarter, path in quarter_files(directory):
+        with EQR_Metrics.stage('write', file=os.path.basename(path)) as record:
+            df = pl.read_parquet(path)
+            write_dataset(df, dataset_dir, year_quarter, compression, row_group_size)
+            record['rows_out'] = df.height
+            record['bytes_read'] = os.path.getsize(path)
+
+
+# Rows of a Dataset for one hub, a range of begin dates [start, end) and some sellers, every argument is optional, e.g.
+#   load_slice(dataset_dir, hub='Mid-Columbia (Mid-C)', start='2022-07-01', end='2022-10-01')
+# Only the row ranges the slice index gives for the matching (hub, year-month, seller) are read, not the whole Dataset
+def load_slice(dataset_dir, hub=None, start=None, end=None, sellers=None, columns=None):
+    start = None if start is None else datetime.datetime.fromisoformat(str(start))
+    end = None if end is None else datetime.datetime.fromisoformat(str(end))
+    if not os.path.isdir(slice_index_dir(dataset_dir)):
+        raise FileNotFoundError(f'No slice index for {dataset_dir}, write it again with write_quarter_dataset.')
+    index = pl.scan_parquet(os.path.join(slice_index_dir(dataset_dir), '*.parquet'))
+    if hub is not None:
+        index = index.filter(pl.col('hub') == hub.upper())
+    if start is not None:
+        index = index.filter(pl.col('month') >= start.strftime('%Y-%m'))
+    if end is not None:
+        index = index.filter(pl.col('month') <= (end - datetime.timedelta(minutes=1)).strftime('%Y-%m'))
+    if sellers is not None:
+        index = index.filter(pl.col('seller').is_in(list(sellers)))
+    index = index.sort(['file', 'first_row']).collect()
+    frames = []
+    for (file, file_hub), ranges in index.group_by(['file', 'hub'], maintain_order=True):
+        # Neighbouring row ranges of a File are read as one
+        runs = []
+        for first_row, rows in ranges.select('first_row', 'rows').iter_rows():
+            if len(runs) > 0 and runs[-1][0] + runs[-1][1] == first_row:
+                runs[-1][1] += rows
+            else:
+                runs.append([first_row, rows])
+        for first_row, rows in runs:
+            frames.append(pl.scan_parquet(os.path.join(dataset_dir, file)).slice(first_row, rows).with_columns(pl.lit(file_hub).alias('hub')))
+    if len(frames) == 0:
+        return pl.DataFrame()
+    df = pl.concat(frames, how='diagonal_relaxed')
+    # Months are the index granularity, the exact range and sellers are filtered on the rows read
+    begin = pl.col('transaction_begin_date')
+    as_value = (lambda value: value.strftime('%Y/%m/%d %H:%M')) if df.collect_schema()['transaction_begin_date'] == pl.Utf8 else (lambda value: value)
+    if start is not None:
+        df = df.filter(begin >= as_value(start))
+    if end is not None:
+        df = df.filter(begin < as_value(end))
+    if sellers is not None:
+        df = df.filter(pl.col('seller_company_name').is_in(list(sellers)))
+    if columns is not None:
+        df = df.select(columns)
+    return df.collect()
+
+
+# Read a spill File back batch_size rows at a time
+def iter_spill(path, batch_size):
+    rows = pl.scan_parquet(path).select(pl.len()).collect().item()
+    for offset in range(0, rows, batch_size):
+        yield pl.scan_parquet(path).slice(offset, batch_size).collect()
+
+
+# Merge spill Files into one Parquet File with the streaming engine, only a few row groups are in Memory at a time
+def merge_spill(paths, path, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE):
+    pl.scan_parquet(paths).sink_parquet(path, compression=compression, row_group_size=row_group_size)
+
+
+# Same for a CSV File, Datetimes are written in the format of EQR_Format.DATETIME_FORMAT
+def merge_spill_csv(paths, path):
+    pl.scan_parquet(paths).sink_csv(path, datetime_format=EQR_Format.DATETIME_FORMAT)
+
+
+# Bytes copied at a time when appending CSV Files
+COPY_SIZE = 16 * 1024 * 1024
+
+# Name of a per-Quarter File, e.g. intermediate_energy_transactions_hourly_2020_Q3.parquet
+QUARTER_FILE = re.compile(r'(\d{4}_Q[1-4])\.parquet$')
+
+
+# Every per-Quarter Parquet File of a Directory as (year_quarter, path), in chronological order so the output is the same on every run
+def quarter_files(directory):
+    files = []
+    for file in os.listdir(directory):
+        year_quarter = QUARTER_FILE.search(file)
+        if year_quarter is not None:
+            files.append((year_quarter.group(1), os.path.join(directory, file)))
+    return sorted(files)
+
+
+# Sidecar index of a final File: header size and, per Quarter, its source, byte offset and size (CSV) and its row range
+# It is rewritten after every completed Quarter, so it is also the checkpoint a restarted concat continues from
+def index_path(output_file_path):
+    return output_file_path + '.index.json'
+
+
+def read_index(output_file_path):
+    if not os.path.exists(index_path(output_file_path)) or not os.path.exists(output_file_path):
+        return None
+    with open(index_path(output_file_path)) as file:
+        return json.load(file)
+
+
+# Write to a temporary File first, an interrupted write never leaves a broken index
+def write_index(output_file_path, index):
+    with open(index_path(output_file_path) + '.tmp', 'w') as file:
+        json.dump(index, file, indent=1)
+    os.replace(index_path(output_file_path) + '.tmp', index_path(output_file_path))
+
+
+# A restart only keeps an output that starts with the header it would write, a header of the same length is not enough
+def header_matches(output_file_path, header):
+    with open(output_file_path, 'rb') as file:
+        return file.read(len(header)) == header
+
+
+# Size and modification time of a source File, a Quarter is only kept on resume when its source did not change
+def source_stamp(path):
+    return [os.path.getsize(path), os.path.getmtime(path)]
+
+
+def quarter_entry(year_quarter, path):
+    return {'year_quarter': year_quarter, 'source': os.path.basename(path), 'stamp': source_stamp(path)}
+
+
+# Number of rows of a Parquet File, from its footer alone
+def parquet_rows(path):
+    return pl.scan_parquet(path).select(pl.len()).collect().item()
+
+
+# Read one Quarter of a final File through its index, only that Quarter's bytes (CSV) or rows (Parquet) are read
+def read_quarter(output_file_path, year_quarter, schema_overrides=None):
+    index = read_index(output_file_path)
+    if index is None:
+        raise FileNotFoundError(f'No index for {output_file_path}.')
+    quarter = [quarter for quarter in index['quarters'] if quarter['year_quarter'] == year_quarter and quarter.get('done', True)]
+    if len(quarter) == 0:
+        raise KeyError(f'{year_quarter} is not in {os.path.basename(output_file_path)}.')
+    quarter = quarter[0]
+    if index['format'] == 'parquet':
+        return pl.scan_parquet(output_file_path).slice(quarter['first_row'], quarter['rows']).collect()
+    with open(output_file_path, 'rb') as file:
+        header = file.read(index['header_bytes'])
+        file.seek(quarter['offset'])
+        data = file.read(quarter['bytes'])
+    return pl.read_csv(header + data, schema_overrides=schema_overrides)
+
+
+# CSV twin written next to a per-Quarter Parquet File (write_csv)
+def csv_twin(path):
+    return path[:-len('.parquet')] + '.csv'
+
+
+# Write the CSV twin of a per-Quarter Parquet File from the same spill Files, right after the Parquet File
+# Its index records the stamps of both Files and the rows, so twin_is_current never parses the twin
+def write_twin(paths, path):
+    merge_spill_csv(paths, csv_twin(path))
+    write_index(csv_twin(path), {'format': 'csv_twin', 'source': os.path.basename(path), 'source_stamp': source_stamp(path),
+                                 'stamp': source_stamp(csv_twin(path)), 'rows': parquet_rows(path)})
+
+
+# Remove a twin and its index
+def remove_twin(path):
+    for file in [csv_twin(path), index_path(csv_twin(path))]:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+# A twin only stands in for its Parquet File when neither changed since write_twin and the Parquet footer gives the rows of the index,
+# e.g. a Parquet File rewritten by an incremental run without its twin is converted again
+def twin_is_current(path):
+    index = read_index(csv_twin(path))
+    return (index is not None and index['format'] == 'csv_twin' and index['source_stamp'] == source_stamp(path)
+            and index['stamp'] == source_stamp(csv_twin(path)) and index['rows'] == parquet_rows(path))
+
+
+# Check from File metadata alone (Parquet footer or CSV header) that every File has the schema of the first one
+def check_schemas(paths):
+    schemas = {}
+    for path in paths:
+        if path.endswith('.parquet'):
+            schemas[path] = list(pl.read_parquet_schema(path).items())
+        else:
+            with open(path, 'rb') as file:
+                schemas[path] = file.readline().rstrip(b'\r\n')
+    mismatched = [os.path.basename(path) for path in paths if schemas[path] != schemas[paths[0]]]
+    if len(mismatched) > 0:
+        raise ValueError(f'Schema of {", ".join(mismatched)} differs from {os.path.basename(paths[0])}.')
+
+
+# Append the CSV twins of per-Quarter Files byte for byte, the header is written once, nothing is parsed
+# Each Quarter is copied into its own region of the output, so workers Threads can copy at once
+# The regions only depend on the sources, so a restart with unchanged sources only copies the Quarters not marked done in the index
+def append_csv(files, output_file_path, workers=4, index=None):
+    check_schemas([path for _, path in files])
+    with open(files[0][1], 'rb') as file:
+        header = file.readline()
+    quarters = []
+    offset = len(header)
+    first_row = 0
+    for year_quarter, path in files:
+        quarter = quarter_entry(year_quarter, path)
+        quarter.update(offset=offset, bytes=os.path.getsize(path) - len(header), first_row=first_row,
+                       rows=parquet_rows(path[:-len('.csv')] + '.parquet'), done=False)
+        quarters.append(quarter)
+        offset += quarter['bytes']
+        first_row += quarter['rows']
+    layout = lambda quarters: [(quarter['year_quarter'], quarter['source'], quarter['stamp'], quarter['offset']) for quarter in quarters]
+    if (index is not None and index['format'] == 'csv_append' and layout(index['quarters']) == layout(quarters)
+            and header_matches(output_file_path, header)):
+        for quarter, indexed in zip(quarters, index['quarters']):
+            quarter['done'] = indexed['done']
+        print('Resume', os.path.basename(output_file_path), 'after', sum(quarter['done'] for quarter in quarters), 'Quarters.')
+    else:
+        with open(output_file_path, 'wb') as output_file:
+            output_file.write(header)
+            output_file.truncate(offset)
+    index = {'format': 'csv_append', 'header_bytes': len(header), 'quarters': quarters, 'complete': False}
+    write_index(output_file_path, index)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(copy_region, output_file_path, (path, len(header), quarter['offset'], quarter['bytes'])): quarter
+                   for quarter, (_, path) in zip(quarters, files) if not quarter['done']}
+        # The index is only written from this Thread, as each copy completes
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            futures[future]['done'] = True
+            write_index(output_file_path, index)
+    index['complete'] = True
+    write_index(output_file_path, index)
+
+
+# Copy one CSV File, without its header, to its region of the output
+def copy_region(output_file_path, region):
+    path, header_size, output_offset, size = region
+    with EQR_Metrics.stage('concat', file=os.path.basename(path)) as record:
+        with open(path, 'rb') as source, open(output_file_path, 'r+b') as output_file:
+            source.seek(header_size)
+            output_file.seek(output_offset)
+            shutil.copyfileobj(source, output_file, COPY_SIZE)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        record['bytes_read'] = record['bytes_written'] = size
+
+
+# Convert one per-Quarter Parquet File to CSV bytes, Polars releases the GIL so several run at once in Threads
+def parquet_to_csv(path, include_header=False):
+    with EQR_Metrics.stage('concat', file=os.path.basename(path)) as record:
+        df = pl.read_parquet(path)
+        data = df.write_csv(include_header=include_header, datetime_format=EQR_Format.DATETIME_FORMAT).encode('utf8')
+        record['rows_out'] = df.height
+        record['bytes_read'] = os.path.getsize(path)
+        record['bytes_written'] = len(data)
+    return data, df.height
+
+
+# CSV bytes of a Quarter from its current twin (see twin_is_current), without the header
+def twin_to_csv(path, twin):
+    with EQR_Metrics.stage('concat', file=os.path.basename(twin)) as record:
+        with open(twin, 'rb') as file:
+            file.readline()
+            data = file.read()
+        rows = parquet_rows(path)
+        record['rows_out'] = rows
+        record['bytes_read'] = record['bytes_written'] = len(data)
+    return data, rows
+
+
+# Convert per-Quarter Parquet Files to one CSV File, workers Quarters are converted at once and written in chronological order
+# The index is written after every Quarter, a restart truncates the output to the end of the last Quarter whose source did not change and goes on from there
+# Quarters of twins ({year_quarter: CSV twin}) are copied from their twin instead of converted
+def convert_csv(files, output_file_path, workers=4, index=None, twins=None):
+    twins = {} if twins is None else twins
+    check_schemas([path for _, path in files])
+    header = pl.read_parquet(files[0][1], n_rows=0).write_csv().encode('utf8')
+    quarters = []
+    if index is not None and index['format'] == 'csv' and index['header_bytes'] == len(header) and header_matches(output_file_path, header):
+        for indexed, (year_quarter, path) in zip(index['quarters'], files):
+            if (indexed['year_quarter'], indexed['source'], indexed['stamp']) != (year_quarter, os.path.basename(path), source_stamp(path)):
+                break
+            quarters.append(indexed)
+        print('Resume', os.path.basename(output_file_path), 'after', len(quarters), 'Quarters.')
+    else:
+        with open(output_file_path, 'wb') as output_file:
+            output_file.write(header)
+    index = {'format': 'csv', 'header_bytes': len(header), 'quarters': quarters, 'complete': False}
+    with open(output_file_path, 'r+b') as output_file, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        offset = quarters[-1]['offset'] + quarters[-1]['bytes'] if quarters else len(header)
+        first_row = quarters[-1]['first_row'] + quarters[-1]['rows'] if quarters else 0
+        output_file.truncate(offset)
+        output_file.seek(offset)
+        write_index(output_file_path, index)
+        # At most two Quarters per Thread are waiting to be written
+        pending = collections.deque()
+        remaining = collections.deque(files[len(quarters):])
+        while remaining or pending:
+            while remaining and len(pending) < workers * 2:
+                year_quarter, path = remaining.popleft()
+                if year_quarter in twins:
+                    pending.append((quarter_entry(year_quarter, path), executor.submit(twin_to_csv, path, twins[year_quarter])))
+                else:
+                    pending.append((quarter_entry(year_quarter, path), executor.submit(parquet_to_csv, path)))
+            quarter, future = pending.popleft()
+            data, rows = future.result()
+            output_file.write(data)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            quarter.update(offset=offset, bytes=len(data), first_row=first_row, rows=rows)
+            quarters.append(quarter)
+            write_index(output_file_path, index)
+            offset += len(data)
+            first_row += rows
+    index['complete'] = True
+    write_index(output_file_path, index)
+
+
+# Append every per-Quarter File of a Directory to one CSV File in chronological order, the header is only written once
+# When every Parquet File has a current CSV twin (write_csv) they are appended byte for byte, otherwise workers Quarters are converted at once
+# and only the Quarters with a current twin are copied from it
+# resume=False starts over, otherwise an interrupted concat continues from its index
+def concat_csv(directory, output_file_path, workers=4, resume=True):
+    files = quarter_files(directory)
+    if len(files) == 0:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(output_file_path)), exist_ok=True)
+    index = read_index(output_file_path) if resume else None
+    twins = {year_quarter: csv_twin(path) for year_quarter, path in files if twin_is_current(path)}
+    with EQR_Metrics.stage('concat', file=os.path.basename(output_file_path)) as concat_record:
+        if len(twins) == len(files):
+            append_csv([(year_quarter, twins[year_quarter]) for year_quarter, _ in files], output_file_path, workers, index)
+        else:
+            convert_csv(files, output_file_path, workers, index, twins)
+        concat_record['bytes_written'] = os.path.getsize(output_file_path)
+
+
+# Concatenate every per-Quarter Parquet File of a Directory into one Parquet File in chronological order, no CSV formatting or parsing
+# The index holds the row range of every Quarter
+def concat_parquet(directory, output_file_path, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE):
+    files = quarter_files(directory)
+    if len(files) == 0:
+        return
+    paths = [path for _, path in files]
+    check_schemas(paths)
+    os.makedirs(os.path.dirname(os.path.abspath(output_file_path)), exist_ok=True)
+    with EQR_Metrics.stage('concat', file=os.path.basename(output_file_path)) as record:
+        merge_spill(paths, output_file_path, compression, row_group_size)
+        quarters = []
+        first_row = 0
+        for year_quarter, path in files:
+            quarter = quarter_entry(year_quarter, path)
+            quarter.update(first_row=first_row, rows=parquet_rows(path))
+            quarters.append(quarter)
+            first_row += quarter['rows']
+        write_index(output_file_path, {'format': 'parquet', 'quarters': quarters, 'complete': True})
+        record['bytes_read'] = sum(os.path.getsize(path) for path in paths)
+        record['bytes_written'] = os.path.getsize(output_file_path)
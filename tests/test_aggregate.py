@@ -0,0 +1,132 @@
+import math
+import numpy as np
+import polars as pl
+import pytest
+import EQR_Aggregate
+import EQR_Format
+import EQR_Synthetic
+
+KEYS = ['day', 'hub']
+MEASURES = {'price': 'price', 'quantity': 'transaction_quantity'}
+
+
+# Rows of a few days and Hubs: skewed positive quantities, prices with zeros, negatives and missing values
+def transactions(rows=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    price = np.round(rng.normal(40, 30, rows), 2)
+    price[rng.random(rows) < 0.05] = 0
+    return pl.DataFrame({
+        'day': rng.integers(1, 6, rows),
+        'hub': rng.choice(['COB', 'MID-C'], rows),
+        'price': price,
+        'transaction_quantity': np.round(rng.lognormal(3, 1.5, rows), 3)
+    }).with_columns(pl.when(pl.int_range(pl.len()) % 97 == 0).then(None).otherwise(pl.col('price')).alias('price'))
+
+
+# Statistics of every group and measure straight from the rows, quantiles as R type 7 (linear)
+def direct(df):
+    frames = []
+    for measure, column in MEASURES.items():
+        x = pl.col(column)
+        frames.append(df.group_by(KEYS).agg(
+            pl.lit(measure).alias('measure'), pl.len().cast(pl.UInt64).alias('rows'), x.count().cast(pl.UInt64).alias('count'),
+            x.mean().alias('mean'), x.std().alias('sd'), x.quantile(0.5, 'linear').alias('median'),
+            x.quantile(0.25, 'linear').alias('q1'), x.quantile(0.75, 'linear').alias('q3'), x.min().alias('min'), x.max().alias('max')))
+    return pl.concat(frames).sort(KEYS + ['measure'])
+
+
+def summarized(sketches):
+    return EQR_Aggregate.summarize(pl.concat(sketches), KEYS).sort(KEYS + ['measure'])
+
+
+# Without an accuracy the Sketch keeps every distinct value, every statistic is exact
+def test_exact_sketch():
+    df = transactions()
+    stats, expected = summarized([EQR_Aggregate.sketch(df, KEYS, MEASURES)]), direct(df)
+    assert stats.select(KEYS + ['measure', 'rows', 'count']).equals(expected.select(KEYS + ['measure', 'rows', 'count']))
+    for column in ['mean', 'sd', 'median', 'q1', 'q3', 'min', 'max']:
+        np.testing.assert_allclose(stats[column].to_numpy(), expected[column].to_numpy(), rtol=1e-9, atol=1e-9)
+
+
+# Sketches of chunks merge into the Sketch of the whole: moments stay exact and quantiles are within the relative accuracy
+@pytest.mark.parametrize('accuracy', [0.01, 0.001])
+def test_merged_chunk_sketches(accuracy):
+    df = transactions(seed=1)
+    chunks = [EQR_Aggregate.sketch(chunk, KEYS, MEASURES, accuracy) for chunk in df.iter_slices(3000)]
+    merged = EQR_Aggregate.merge_sketch(pl.concat(chunks).lazy()).collect()
+    assert merged.height < sum(chunk.height for chunk in chunks)
+    assert EQR_Aggregate.merge_sketch(merged.lazy()).collect().sort(merged.columns).equals(merged.sort(merged.columns))
+
+    stats, expected = summarized(chunks), direct(df)
+    assert stats.select(KEYS + ['measure', 'rows', 'count']).equals(expected.select(KEYS + ['measure', 'rows', 'count']))
+    np.testing.assert_allclose(stats['mean'].to_numpy(), expected['mean'].to_numpy(), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(stats['sd'].to_numpy(), expected['sd'].to_numpy(), rtol=1e-9)
+    for column in ['median', 'q1', 'q3', 'min', 'max']:
+        error = (stats[column] - expected[column]).abs().to_numpy()
+        assert (error <= accuracy * expected[column].abs().to_numpy() + 1e-9).all(), column
+    assert stats.filter(pl.col('measure') == 'price')['rows'].sum() == df.height
+
+
+# daily_by_hub from the Sketch Files of two chunks equals the table of Cluster_Analysis built from the rows
+def test_daily_by_hub(tmp_path):
+    df = EQR_Format.fix_data_format(EQR_Synthetic.make_transactions(5000, '2024_Q1', seed=2))
+    paths = []
+    for i, chunk in enumerate([df.head(2000), df.slice(2000)]):
+        paths.append(str(tmp_path / f'sketch_{i}.parquet'))
+        EQR_Aggregate.daily_by_hub_sketch(chunk).write_parquet(paths[-1])
+    table = EQR_Aggregate.daily_by_hub(paths)
+
+    rows = (df.filter((pl.col('rate_units').cast(pl.Utf8) == '$/MWH') & pl.col('price').is_not_null() & pl.col('transaction_quantity').is_not_null())
+              .select(pl.col('transaction_begin_date').dt.date(), pl.col('point_of_delivery_specific_location').str.to_uppercase().alias('hub'),
+                      pl.col('price').cast(pl.Float64), pl.col('transaction_quantity').cast(pl.Float64)))
+    expected = rows.group_by(EQR_Aggregate.DAILY_BY_HUB_KEYS).agg(
+        pl.col('price').mean().alias('avg_price'), pl.col('price').median().alias('median_price'), pl.col('price').std().alias('price_sd'),
+        pl.col('transaction_quantity').mean().alias('avg_quantity'), pl.col('transaction_quantity').median().alias('median_quantity'),
+        pl.col('transaction_quantity').std().alias('quantity_sd'), pl.len().cast(pl.UInt64).alias('num_transactions')
+    ).sort(EQR_Aggregate.DAILY_BY_HUB_KEYS)
+    assert table.select(EQR_Aggregate.DAILY_BY_HUB_KEYS + ['num_transactions']).equals(expected.select(EQR_Aggregate.DAILY_BY_HUB_KEYS + ['num_transactions']))
+    for column in ['avg_price', 'median_price', 'price_sd', 'avg_quantity', 'median_quantity', 'quantity_sd']:
+        np.testing.assert_allclose(table[column].to_numpy(), expected[column].to_numpy(), rtol=1e-9, atol=1e-9, err_msg=column)
+
+
+# Transaction ids of three groups: many, some and few distinct ids, every id repeated
+def ids():
+    return pl.DataFrame({
+        'level': ['many'] * 200000 + ['some'] * 4000 + ['few'] * 100,
+        'transaction_unique_id': [f'T{i % 100000}' for i in range(200000)] + [f'T{i % 2000}' for i in range(4000)] + [f'U{i % 50}' for i in range(100)]
+    })
+
+
+# Distinct Sketches of chunks merge into the exact count, or a HyperLogLog estimate within 4 standard errors (1.04 / sqrt(2^precision))
+@pytest.mark.parametrize('precision', [None, 10, 14])
+def test_distinct_sketch(precision):
+    df = ids().sample(fraction=1, shuffle=True, seed=0)
+    sketches = [EQR_Aggregate.distinct_sketch(chunk, ['level'], 'transaction_unique_id', precision) for chunk in df.iter_slices(25000)]
+    counts = EQR_Aggregate.distinct_count(pl.concat(sketches), ['level'], precision).sort('level')
+    expected = df.group_by('level').agg(pl.col('transaction_unique_id').n_unique().alias('distinct')).sort('level')
+    assert counts['level'].to_list() == expected['level'].to_list()
+    if precision is None:
+        assert counts['distinct'].to_list() == expected['distinct'].to_list()
+    else:
+        error = (counts['distinct'].cast(pl.Float64) / expected['distinct'] - 1).abs()
+        assert (error <= 4 * 1.04 / math.sqrt(2 ** precision)).all(), error.to_list()
+
+
+# Cube of two chunks of rows against a group_by per dimension: rows, distinct Transactions and mean exact, quantiles within the Cube accuracy
+def test_cube_sketch():
+    df = EQR_Format.fix_data_format(EQR_Synthetic.make_transactions(6000, '2024_Q1', seed=4))
+    values, distinct = zip(*[EQR_Aggregate.cube_sketch(chunk) for chunk in [df.head(2500), df.slice(2500)]])
+    stats = EQR_Aggregate.summarize(pl.concat(values), EQR_Aggregate.CUBE_KEYS)
+    counts = EQR_Aggregate.distinct_count(pl.concat(distinct), EQR_Aggregate.CUBE_KEYS)
+    for dimension in ['type_of_rate', 'increment_name', 'month']:
+        level = EQR_Aggregate.CUBE_DIMENSIONS[dimension].alias('level')
+        expected = df.group_by(level).agg(pl.len().cast(pl.UInt64).alias('rows'), pl.col('transaction_unique_id').n_unique().alias('distinct'),
+                                          pl.col('price').cast(pl.Float64).mean().alias('mean'),
+                                          pl.col('price').cast(pl.Float64).quantile(0.5, 'linear').alias('median')).sort('level')
+        price = stats.filter(pl.col('dimension') == dimension, pl.col('measure') == 'price').sort('level')
+        assert price['level'].to_list() == expected['level'].to_list()
+        assert price['rows'].to_list() == expected['rows'].to_list()
+        assert counts.filter(pl.col('dimension') == dimension).sort('level')['distinct'].to_list() == expected['distinct'].to_list()
+        np.testing.assert_allclose(price['mean'].to_numpy(), expected['mean'].to_numpy(), rtol=1e-9)
+        error = (price['median'] - expected['median']).abs().to_numpy()
+        assert (error <= EQR_Aggregate.CUBE_QUANTILE_ACCURACY * expected['median'].abs().to_numpy() + 1e-9).all()
@@ -0,0 +1,28 @@
+import os
+import pytest
+import EQR_Bench
+
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+
+BENCH_ARGUMENTS = {'companies': 4, 'rows_per_company': 1000, 'seed': 0}
+
+
+# A directory passed by the caller is kept, only what the run created in it is removed
+def test_bench_keeps_caller_directory(tmp_path):
+    (tmp_path / 'notes.txt').write_text('keep')
+    results = EQR_Bench.bench(directory=str(tmp_path), **BENCH_ARGUMENTS)
+    assert [result['stage'] for result in results][-1] == 'pipeline'
+    assert sorted(os.listdir(tmp_path)) == ['notes.txt']
+
+
+# Repeatable benchmark of the synthetic Quarter, stage results go to the extra info of the run:
+#   python -m pytest tests/test_bench.py --benchmark-only --benchmark-json bench.json
+@pytest.mark.skipif(pytest_benchmark is None, reason='pytest-benchmark is not installed')
+def test_bench_pipeline(benchmark, tmp_path):
+    results = benchmark.pedantic(EQR_Bench.bench, kwargs=dict(directory=str(tmp_path), **BENCH_ARGUMENTS), rounds=3, iterations=1)
+    benchmark.extra_info['stages'] = results
+    assert all(result['rows_out'] is not None for result in results)
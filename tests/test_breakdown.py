@@ -0,0 +1,183 @@
+import math
+import random
+import datetime
+import holidays
+import polars as pl
+import pytest
+import EQR_Breakdown
+import EQR_Format
+import EQR_Read_Daily
+import EQR_Read_Hourly
+
+
+# Per-row loop of breakdown_to_hourly and breakdown_to_daily before the columnar Breakdown, kept to pin its results
+# period: length of one period, floor: start of the period of a Datetime, peaking_error: (increment_peaking_name, start_time) -> bool
+def NERC_holiday(year):
+    return [day for day, name in holidays.UnitedStates(years=year).items()
+            if name in {"New Year's Day", 'Memorial Day', 'Independence Day', 'Labor Day', 'Thanksgiving', 'Christmas Day'}]
+
+
+def hourly_peaking_error(increment_peaking_name, start_time):
+    if increment_peaking_name == 'OP':
+        return (start_time.weekday() != 6 and start_time.hour >= 6 and start_time.hour <= 21 and
+                start_time.date() not in NERC_holiday(start_time.year))
+    if increment_peaking_name == 'P':
+        return (start_time.hour < 6 or start_time.hour > 21 or start_time.weekday() == 6 or
+                start_time.date() in NERC_holiday(start_time.year))
+    return False
+
+
+def daily_peaking_error(increment_peaking_name, start_time):
+    if increment_peaking_name == 'P':
+        return start_time.weekday() == 6 or start_time.date() in NERC_holiday(start_time.year)
+    return False
+
+
+def floor_to(moment, period):
+    return datetime.datetime.min + ((moment - datetime.datetime.min) // period) * period
+
+
+REFERENCES = {
+    '15min': (datetime.timedelta(minutes=15), hourly_peaking_error),
+    'hourly': (datetime.timedelta(hours=1), hourly_peaking_error),
+    'daily': (datetime.timedelta(days=1), daily_peaking_error)
+}
+
+
+def reference_breakdown(df, granularity):
+    period, peaking_error = REFERENCES[granularity]
+    seconds = period.total_seconds()
+    expanded_rows = []
+    for row in df.with_columns(pl.col('transaction_begin_date', 'transaction_end_date').str.to_datetime(format='%Y%m%d%H%M'),
+                               pl.col('standardized_quantity', 'total_transaction_charge').cast(pl.Float32)).iter_rows(named=True):
+        begin_date = row['transaction_begin_date']
+        end_date = row['transaction_end_date']
+        if row['standardized_quantity'] is None:
+            row['standardized_quantity'] = 0
+        if row['standardized_quantity'] == 0 and row['transaction_quantity'] != 0 and row['rate_units'] == '$/MWH':
+            row['standardized_quantity'] = row['transaction_quantity']
+        if begin_date == end_date:
+            expanded_rows.append(dict(row, duration=1))
+            continue
+        total_duration = (end_date - begin_date).total_seconds()
+        current_date = begin_date
+        rows_of_one_transaction = []
+        while current_date < end_date:
+            start_time = begin_date if current_date == begin_date else floor_to(current_date, period)
+            end_time = end_date if floor_to(current_date, period) == floor_to(end_date, period) else floor_to(current_date, period) + period - datetime.timedelta(minutes=1)
+            if peaking_error(row['increment_peaking_name'], start_time):
+                total_duration -= seconds
+                current_date += period
+                continue
+            current_date_duration = (end_time - start_time).total_seconds()
+            new_row = dict(row, transaction_begin_date=start_time, transaction_end_date=end_time)
+            new_row['transaction_quantity'] = row['transaction_quantity'] * current_date_duration / total_duration
+            new_row['standardized_quantity'] = row['standardized_quantity'] * current_date_duration / total_duration
+            new_row['total_transaction_charge'] = new_row['transaction_quantity'] * new_row['price'] + new_row['total_transmission_charge']
+            rows_of_one_transaction.append(new_row)
+            current_date += period
+        for one_row in rows_of_one_transaction:
+            one_row['duration'] = math.ceil(total_duration / seconds)
+            expanded_rows.append(one_row)
+    return expanded_rows
+
+
+def transaction(i, begin, end, peaking=None, quantity=1234.5, standardized_quantity=None, rate_units='$/MWH', increment='H'):
+    return {
+        'transaction_unique_id': f'T{i}', 'seller_company_name': 'A', 'customer_company_name': 'C', 'ferc_tariff_reference': 'x',
+        'contract_service_agreement': 'y', 'transaction_unique_identifier': f'U{i}',
+        'transaction_begin_date': begin.strftime('%Y%m%d%H%M'), 'transaction_end_date': end.strftime('%Y%m%d%H%M'), 'trade_date': 20200101,
+        'exchange_brokerage_service': None, 'type_of_rate': 'Fixed', 'time_zone': 'PP', 'point_of_delivery_balancing_authority': 'HUB',
+        'point_of_delivery_specific_location': 'COB', 'class_name': 'F', 'term_name': 'ST', 'increment_name': increment,
+        'increment_peaking_name': peaking, 'product_name': 'ENERGY', 'transaction_quantity': quantity, 'price': 31.25, 'rate_units': rate_units,
+        'standardized_quantity': standardized_quantity, 'standardized_price': None, 'total_transmission_charge': 3.5, 'total_transaction_charge': '10'
+    }
+
+
+# Edge cases: partial first and last periods, P/OP exclusions (weekend, NERC Holiday), zero-length and reversed ranges
+def edge_transactions():
+    at = datetime.datetime
+    cases = [
+        (at(2020, 3, 2, 9, 20), at(2020, 3, 2, 13, 40), None),  # partial first and last hour
+        (at(2020, 3, 2, 9, 5), at(2020, 3, 2, 9, 50), None),  # within one hour
+        (at(2020, 3, 2, 22, 30), at(2020, 3, 3, 1, 15), None),  # across midnight
+        (at(2020, 3, 6, 20, 10), at(2020, 3, 9, 8, 45), 'P'),  # peak over a weekend
+        (at(2020, 3, 6, 20, 10), at(2020, 3, 9, 8, 45), 'OP'),  # off-peak over a weekend
+        (at(2020, 12, 24, 5, 0), at(2020, 12, 26, 23, 0), 'P'),  # Christmas Day
+        (at(2020, 12, 24, 5, 0), at(2020, 12, 26, 23, 0), 'OP'),
+        (at(2020, 7, 1, 0, 0), at(2020, 7, 8, 0, 0), 'FP'),
+        (at(2020, 3, 2, 10, 0), at(2020, 3, 2, 10, 0), 'P'),  # zero-length
+        (at(2020, 3, 2, 10, 0), at(2020, 3, 2, 7, 0), None),  # reversed
+        (at(2020, 3, 2, 10, 7), at(2020, 3, 2, 10, 52), None),  # 15 minute partial periods
+    ]
+    rows = [transaction(i, begin, end, peaking, increment='15') for i, (begin, end, peaking) in enumerate(cases)]
+    rows.append(transaction(len(rows), at(2020, 3, 2, 9, 0), at(2020, 3, 2, 12, 0), standardized_quantity='12.5'))
+    rows.append(transaction(len(rows), at(2020, 3, 2, 9, 0), at(2020, 3, 2, 12, 0), quantity=0.0, rate_units='$/KWH'))
+    return pl.DataFrame(rows, schema=EQR_Format.DATATYPES)
+
+
+def random_transactions(n, seed):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        begin = datetime.datetime(2014, 1, 1) + datetime.timedelta(minutes=rnd.randrange(0, 10 * 365 * 24 * 60))
+        if rnd.random() < 0.5:
+            begin = begin.replace(minute=0)
+        kind = rnd.random()
+        if kind < 0.1:
+            end = begin
+        elif kind < 0.15:
+            end = begin - datetime.timedelta(hours=rnd.randrange(1, 5))
+        else:
+            end = begin + datetime.timedelta(minutes=rnd.randrange(1, 3 * 24 * 60))
+        rows.append(transaction(i, begin, end, rnd.choice(['OP', 'P', 'FP', None]), float(rnd.choice([0, 25, 1234.5])),
+                                rnd.choice([None, '0', '12.5']), rnd.choice(['$/MWH', '$/KWH', None]), rnd.choice(['H', 'D', '5', '15'])))
+    return pl.DataFrame(rows, schema=EQR_Format.DATATYPES)
+
+
+def assert_parity(df, granularity, breakdown_df):
+    duration_column = EQR_Breakdown.GRANULARITIES[granularity]['duration_column']
+    columns = ['transaction_unique_id', 'transaction_begin_date', 'transaction_end_date', 'transaction_quantity',
+               'standardized_quantity', 'total_transaction_charge']
+    schema = {column: breakdown_df.schema[column] for column in columns}
+    schema['duration'] = breakdown_df.schema[duration_column]
+    expected = pl.DataFrame([{column: row[column] for column in schema} for row in reference_breakdown(df, granularity)], schema=schema)
+    actual = breakdown_df.select(columns + [pl.col(duration_column).alias('duration')])
+    assert actual.height == expected.height
+    assert actual.equals(expected)
+
+
+@pytest.mark.parametrize('granularity', ['15min', 'hourly', 'daily'])
+def test_edge_cases(granularity):
+    df = edge_transactions()
+    assert_parity(df, granularity, EQR_Breakdown.breakdown(df, granularity))
+
+
+@pytest.mark.parametrize('granularity', ['15min', 'hourly', 'daily'])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_random_transactions(granularity, seed):
+    df = random_transactions(300, seed)
+    assert_parity(df, granularity, EQR_Breakdown.breakdown(df, granularity))
+
+
+def test_script_entry_points():
+    df = random_transactions(100, 2)
+    assert_parity(df, 'hourly', EQR_Read_Hourly.breakdown_to_hourly(df))
+    assert_parity(df, 'daily', EQR_Read_Daily.breakdown_to_daily(df))
+
+
+def test_edge_rows():
+    df = edge_transactions()
+    hourly = EQR_Breakdown.breakdown(df, 'hourly')
+    # The partial first and last hours keep their own begin and end minutes
+    first = hourly.filter(pl.col('transaction_unique_id') == 'T0')
+    assert first['transaction_begin_date'].dt.strftime('%H:%M').to_list() == ['09:20', '10:00', '11:00', '12:00', '13:00']
+    assert first['transaction_end_date'].dt.strftime('%H:%M').to_list() == ['09:59', '10:59', '11:59', '12:59', '13:40']
+    # Zero-length Transactions stay as one row, reversed ones are dropped
+    assert hourly.filter(pl.col('transaction_unique_id') == 'T8').height == 1
+    assert hourly.filter(pl.col('transaction_unique_id') == 'T9').height == 0
+    # Peak Transactions skip Sundays and NERC Holidays, off-peak ones skip peak hours
+    peak = hourly.filter(pl.col('transaction_unique_id').is_in(['T3', 'T5']))['transaction_begin_date']
+    assert (peak.dt.weekday() != 7).all() and not (peak.dt.date() == datetime.date(2020, 12, 25)).any()
+    off_peak = hourly.filter(pl.col('transaction_unique_id') == 'T4')['transaction_begin_date']
+    assert not ((off_peak.dt.weekday() < 7) & off_peak.dt.hour().is_between(6, 21)).any()
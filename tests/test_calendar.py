@@ -0,0 +1,19 @@
+import datetime
+import warnings
+import polars as pl
+import EQR_Calendar
+
+
+# Holidays inside the precomputed Calendar and outside of it (generated on demand) give the same flags, without Polars warnings
+def test_holiday_and_peak_flags():
+    timestamps = pl.Series([datetime.datetime(2024, 12, 25, 12), datetime.datetime(2024, 12, 26, 12), datetime.datetime(2024, 12, 29, 12),
+                            datetime.datetime(2040, 7, 4, 12), datetime.datetime(2040, 7, 5, 12), datetime.datetime(2040, 7, 5, 5)])
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        holiday = EQR_Calendar.holiday_mask(timestamps).to_list()
+        peak = EQR_Calendar.peak_mask(timestamps).to_list()
+        single = [EQR_Calendar.is_peak(ts) for ts in timestamps]
+    assert holiday == [True, False, False, True, False, False]
+    assert peak == [False, True, False, False, True, False]
+    assert single == peak
+    assert [str(warning.message) for warning in caught] == []
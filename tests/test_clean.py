@@ -0,0 +1,104 @@
+import os
+import datetime
+import polars as pl
+import pytest
+import EQR_Breakdown
+import EQR_Clean
+import EQR_Format
+import EQR_Pipeline
+import EQR_Synthetic
+
+
+def prices():
+    return pl.DataFrame({'price': [-30.0, 0.0, 10.0, None, 2500.0], 'transaction_quantity': [5.0, 20000.0, 0.0, 3.0, 1.0],
+                         'rate_units': ['$/MWH', '$/MWH', '$/KW-MO', '$/MWH', None]})
+
+
+# Every operator, reject, and missing values failing a condition
+@pytest.mark.parametrize('rule, expected', [
+    ({'price': {'between': [-20, 2000]}}, [False, True, True, False, False]),
+    ({'price': {'equal': 0}}, [False, True, False, False, False]),
+    ({'price': {'not_equal': 0}}, [True, False, True, False, True]),
+    ({'price': {'less_than': 0}}, [True, False, False, False, False]),
+    ({'price': {'greater_equal': 10}}, [False, False, True, False, True]),
+    ({'price': {'in': [0, 10]}}, [False, True, True, False, False]),
+    ({'price': {'not_null': True}}, [True, True, True, False, True]),
+    ({'rate_units': {'equal': '$/MWH'}}, [True, True, False, True, False]),
+    ({'price': {'greater_than': -20}, 'transaction_quantity': {'less_equal': 10000}}, [False, False, True, False, True]),
+    ({'reject': True, 'price': {'equal': 0}, 'transaction_quantity': {'greater_than': 10000}}, [True, False, True, True, True])  # not (missing and false) is true, as in R
+])
+def test_rule_expression(rule, expected):
+    assert prices().select(EQR_Clean.rule_expression(rule)).to_series().to_list() == expected
+
+
+def test_unknown_operator_and_stage():
+    with pytest.raises(ValueError):
+        EQR_Clean.rule_expression({'price': {'around': 0}})
+    with pytest.raises(ValueError):
+        EQR_Clean.rule_expression({'stage': 'later', 'price': {'equal': 0}})
+
+
+# A row failing several Rules counts for each of them
+def test_clean_counts():
+    totals = {}
+    kept, rejected = EQR_Clean.clean(prices(), EQR_Clean.stage_rules(EQR_Clean.STUDY_RULES, 'filed') | EQR_Clean.stage_rules(EQR_Clean.STUDY_RULES, 'breakdown'), totals)
+    assert kept['price'].to_list() == []
+    assert rejected.height == 5
+    assert totals == {'rows_in': 5, 'rows_out': 0, 'rejected_price_range': 3, 'rejected_positive_quantity': 1,
+                      'rejected_free_bulk_energy': 1, 'rejected_quantity_limit': 0}
+    kept, rejected = EQR_Clean.clean(prices(), EQR_Clean.stage_rules(EQR_Clean.STUDY_RULES, 'filed'))
+    assert kept['price'].to_list() == [0.0, 10.0]
+    assert kept.height + rejected.height == 5
+
+
+def test_load_cleaning(tmp_path):
+    path = tmp_path / 'cleaning.toml'
+    path.write_text('[cleaning.energy.cheap]\nprice = { less_than = 100 }\n\n'
+                    '[cleaning.energy.small]\nstage = "breakdown"\ntransaction_quantity = { less_equal = 10 }\n')
+    cleaning = EQR_Clean.load_cleaning(str(path))
+    assert list(EQR_Clean.stage_rules(cleaning['energy'], 'filed')) == ['cheap']
+    assert list(EQR_Clean.stage_rules(cleaning['energy'], 'breakdown')) == ['small']
+    assert EQR_Clean.load_cleaning('study') is EQR_Clean.CLEANING['study']
+    path.write_text('[cleaning.energy.cheap]\nprice = { around = 100 }\n')
+    with pytest.raises(ValueError):
+        EQR_Clean.load_cleaning(str(path))
+
+
+# Transactions of one Hub: a 30 day Contract of 100000 MWh (about 139 MWh an hour), one hour of 60000 MWh, a Price of 3000 and a normal hour
+def contracts():
+    df = EQR_Synthetic.make_transactions(4, '2024_Q1', hubs={'COB': 1}, products={'ENERGY': 1}, peaking={'FP': 1}, long_term_share=0)
+    return df.with_columns(
+        pl.Series('transaction_begin_date', ['202401010000', '202402010000', '202402020000', '202402030000']),
+        pl.Series('transaction_end_date', ['202401310000', '202402010100', '202402020100', '202402030100']),
+        pl.Series('transaction_quantity', [100000.0, 60000.0, 10.0, 10.0], dtype=pl.Float32),
+        pl.Series('price', [30.0, 30.0, 3000.0, 30.0], dtype=pl.Float32),
+        pl.lit('$/MWH').alias('rate_units'),
+        pl.lit(None, dtype=pl.Utf8).alias('standardized_quantity'),
+        pl.lit('HUB').alias('point_of_delivery_balancing_authority')
+    ).cast(EQR_Format.DATATYPES)
+
+
+# The Study quantity limits drop the hours of a Contract over the limit, not the Contract, and rejected rows reach the quarantine Files
+def test_study_cleaning_with_quarantine(tmp_path):
+    granularities = ['no_breakdown', 'hourly']
+    outputs = {'energy': {granularity: str(tmp_path / f'{granularity}.parquet') for granularity in granularities}}
+    EQR_Pipeline.add_quarantine(outputs, 'energy', EQR_Clean.STUDY_RULES, '2024_Q1')
+    outputs = {key: {granularity: str(tmp_path / f'{key}_{granularity}.parquet') for granularity in key_outputs} for key, key_outputs in outputs.items()}
+    assert outputs == {'energy': {granularity: str(tmp_path / f'energy_{granularity}.parquet') for granularity in ['no_breakdown', 'hourly', 'no_breakdown_quarantine', 'hourly_quarantine']},
+                       'energy_quarantine': {'raw': str(tmp_path / 'energy_quarantine_raw.parquet')}}
+
+    with pl.StringCache():
+        rows = EQR_Pipeline.stream_frames([contracts()], EQR_Format.DATATYPES, lambda df: {'energy': df}, outputs,
+                                          {key: str(tmp_path / ('temp_' + key)) for key in outputs}, cleaning={'energy': EQR_Clean.STUDY_RULES})
+    assert rows == {'energy': 3, 'energy_quarantine': 1}
+    read = {(key, granularity): pl.read_parquet(path) for key, key_outputs in outputs.items() for granularity, path in key_outputs.items()}
+
+    assert read['energy_quarantine', 'raw']['price'].to_list() == [3000.0]
+    assert read['energy', 'no_breakdown']['transaction_quantity'].to_list() == [10.0]
+    assert read['energy', 'no_breakdown_quarantine']['transaction_quantity'].to_list() == [100000.0, 60000.0]
+    with pl.StringCache():
+        assert read['energy', 'hourly'].equals(EQR_Breakdown.breakdown(contracts()[[0, 3]], 'hourly'))
+    assert read['energy', 'hourly'].height == 30 * 24 + 1
+    assert read['energy', 'hourly_quarantine']['transaction_quantity'].to_list() == [59000.0]  # 00:00 to 00:59 of the 60 minutes
+    assert read['energy', 'hourly_quarantine']['transaction_begin_date'].to_list() == [datetime.datetime(2024, 2, 1)]
+    assert not any(os.path.exists(tmp_path / ('temp_' + key)) for key in outputs)
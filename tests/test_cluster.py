@@ -0,0 +1,84 @@
+import numpy as np
+import polars as pl
+import pytest
+import EQR_Cluster
+
+CENTERS = np.array([[0, 0, 0], [8, 8, 0], [0, 8, 8], [8, 0, 8]], dtype=float)
+
+
+# Well separated blobs around CENTERS, rows shuffled
+def blobs(rows_per_center=150, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.concatenate([center + rng.normal(0, 0.5, (rows_per_center, CENTERS.shape[1])) for center in CENTERS])
+    labels = np.repeat(np.arange(len(CENTERS)), rows_per_center)
+    order = rng.permutation(len(x))
+    return x[order], labels[order]
+
+
+# O(n^2) silhouette of every row as in cluster::silhouette, a Cluster of one row scores 0
+def naive_silhouette(x, labels):
+    distances = np.sqrt(((x[:, None, :] - x[None, :, :]) ** 2).sum(axis=2))
+    scores = []
+    for i in range(len(x)):
+        own = labels == labels[i]
+        if own.sum() == 1:
+            scores.append(0.0)
+            continue
+        a = distances[i, own].sum() / (own.sum() - 1)
+        b = min(distances[i, labels == k].mean() for k in np.unique(labels) if k != labels[i])
+        scores.append((b - a) / max(a, b))
+    return float(np.mean(scores))
+
+
+def test_standardize():
+    x = np.column_stack([np.arange(10.0), np.full(10, 3.0), np.linspace(-5, 20, 10) ** 2])
+    z = EQR_Cluster.standardize(x)
+    np.testing.assert_allclose(z.mean(axis=0), 0, atol=1e-12)
+    np.testing.assert_allclose(z.std(axis=0, ddof=1), [1, 0, 1])
+
+
+# Shares are the eigenvalues of the covariance, the kept scores are the projections on the first Components
+def test_pca():
+    rng = np.random.default_rng(1)
+    x = EQR_Cluster.standardize(rng.normal(size=(300, 5)) @ rng.normal(size=(5, 5)))
+    scores, sd, shares = EQR_Cluster.pca(x, 0.9)
+    eigenvalues = np.sort(np.linalg.eigvalsh(np.cov(x, rowvar=False)))[::-1]
+    np.testing.assert_allclose(sd ** 2, eigenvalues, rtol=1e-9)
+    np.testing.assert_allclose(shares, eigenvalues / eigenvalues.sum(), rtol=1e-9)
+    kept = scores.shape[1]
+    assert shares[:kept].sum() >= 0.9 > shares[:kept - 1].sum()
+    full, _, _ = EQR_Cluster.pca(x, 1)
+    np.testing.assert_allclose(np.linalg.norm(full[:5] - full[5:10], axis=1), np.linalg.norm(x[:5] - x[5:10], axis=1))
+
+
+# k-means finds the blobs: every Cluster is one blob and its Center is the blob Center
+def test_kmeans_recovers_centers():
+    x, truth = blobs()
+    wss, labels, iterations = EQR_Cluster.kmeans(x, len(CENTERS), [EQR_Cluster.SEED, 4, 0])
+    assert iterations < EQR_Cluster.MAX_ITERATIONS
+    for k in range(len(CENTERS)):
+        assert len(np.unique(truth[labels == k])) == 1
+        np.testing.assert_allclose(x[labels == k].mean(axis=0), CENTERS[truth[labels == k][0]], atol=0.15)
+    assert wss == pytest.approx(sum(((x[labels == k] - x[labels == k].mean(axis=0)) ** 2).sum() for k in range(len(CENTERS))))
+
+
+# The blocked silhouette equals the O(n^2) one on every row (up to the rounding of the squared distances), with a singleton Cluster too, and on a sample it stays close
+def test_silhouette_matches_naive():
+    x, truth = blobs(60)
+    labels = truth.copy()
+    labels[0] = len(CENTERS)  # a Cluster of one row
+    assert EQR_Cluster.sampled_silhouette(x, labels, sample_size=len(x), block_size=37) == pytest.approx(naive_silhouette(x, labels), rel=1e-8)
+    noisy = np.random.default_rng(2).integers(0, 3, len(x))
+    assert EQR_Cluster.sampled_silhouette(x, noisy, sample_size=len(x)) == pytest.approx(naive_silhouette(x, noisy), rel=1e-8)
+    assert EQR_Cluster.sampled_silhouette(x, truth, sample_size=120) == pytest.approx(naive_silhouette(x, truth), abs=0.05)
+
+
+# Runs are seeded by (seed, k, restart), the sweep is the same with one Process or a pool of Workers, and the silhouette picks the blobs
+def test_sweep_does_not_depend_on_workers():
+    x, truth = blobs(80)
+    single, single_labels = EQR_Cluster.sweep(x, range(2, 6), restarts=3, workers=1)
+    pooled, pooled_labels = EQR_Cluster.sweep(x, range(2, 6), restarts=3, workers=2)
+    assert single.equals(pooled)
+    assert all((single_labels[k] == pooled_labels[k]).all() for k in single_labels)
+    assert single.sort('silhouette', descending=True)['k'][0] == len(CENTERS)
+    assert single['wss'].is_sorted(descending=True)
@@ -0,0 +1,76 @@
+import os
+import datetime
+import polars as pl
+import pytest
+import EQR_Format
+import EQR_Synthetic
+import EQR_Writer
+
+QUARTERS = ['2023_Q4', '2024_Q1', '2024_Q2']
+HUBS = {'Mid-Columbia (Mid-C)': 0.5, 'COB': 0.3, 'mid-columbia (mid-c)': 0.2}
+
+
+# Per-Quarter Files of three Sellers written into a Dataset, returns its directory and every row
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('energy_daily')
+    frames = []
+    for i, year_quarter in enumerate(QUARTERS):
+        df = pl.concat([EQR_Synthetic.make_transactions(400, year_quarter, seed=10 * i + j, company=seller, hubs=HUBS)
+                        for j, seller in enumerate(['Seller A', 'Seller B', 'Seller C'])])
+        df = EQR_Format.fix_data_format(df)
+        df.write_parquet(directory / f'intermediate_energy_transactions_daily_{year_quarter}.parquet')
+        frames.append(df)
+    dataset_dir = str(directory / 'final_energy_transactions_daily')
+    EQR_Writer.write_quarter_dataset(str(directory), dataset_dir)
+    return dataset_dir, pl.concat(frames)
+
+
+# Same slice from every row
+def full_scan(df, hub=None, start=None, end=None, sellers=None):
+    df = df.with_columns(pl.col('point_of_delivery_specific_location').str.to_uppercase().alias('hub'))
+    if hub is not None:
+        df = df.filter(pl.col('hub') == hub.upper())
+    if start is not None:
+        df = df.filter(pl.col('transaction_begin_date') >= datetime.datetime.fromisoformat(start))
+    if end is not None:
+        df = df.filter(pl.col('transaction_begin_date') < datetime.datetime.fromisoformat(end))
+    if sellers is not None:
+        df = df.filter(pl.col('seller_company_name').is_in(sellers))
+    return df
+
+
+def sorted_rows(df):
+    return df.sort('transaction_unique_id', 'seller_company_name', 'transaction_begin_date')
+
+
+@pytest.mark.parametrize('arguments', [
+    {'hub': 'Mid-Columbia (Mid-C)', 'start': '2024-02-01', 'end': '2024-03-01'},
+    {'hub': 'COB', 'start': '2024-03-20', 'end': '2024-04-10'},  # crosses Quarters
+    {'start': '2023-12-15 06:00', 'end': '2024-01-15', 'sellers': ['Seller B', 'Seller C']},
+    {'sellers': ['Seller A']},
+    {}
+])
+def test_load_slice_matches_full_scan(dataset, arguments):
+    dataset_dir, df = dataset
+    expected = full_scan(df, **arguments)
+    sliced = EQR_Writer.load_slice(dataset_dir, **arguments)
+    assert expected.height > 0
+    assert sorted_rows(sliced).equals(sorted_rows(expected.select(sliced.columns)))
+
+
+# A slice of a Hub or a period without rows is empty
+@pytest.mark.parametrize('arguments', [{'hub': 'Palo Verde'}, {'start': '2030-01-01'}, {'hub': 'COB', 'sellers': ['Seller D']}])
+def test_empty_slice(dataset, arguments):
+    dataset_dir, df = dataset
+    assert full_scan(df, **arguments).height == 0
+    assert EQR_Writer.load_slice(dataset_dir, **arguments).height == 0
+
+
+# The index covers every row once, one contiguous run per (Hub, month, Seller) of each File
+def test_slice_index_covers_every_row(dataset):
+    dataset_dir, df = dataset
+    index = pl.read_parquet(os.path.join(EQR_Writer.slice_index_dir(dataset_dir), '*.parquet'))
+    assert index['rows'].sum() == df.height
+    assert index.select('hub', 'month', 'seller', 'file').is_unique().all()
+    assert sorted(os.listdir(EQR_Writer.slice_index_dir(dataset_dir))) == [year_quarter + '.parquet' for year_quarter in QUARTERS]
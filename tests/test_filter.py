@@ -0,0 +1,32 @@
+import polars as pl
+import EQR_Filter
+import EQR_Format
+import EQR_Read_Daily
+import EQR_Read_Hourly
+import EQR_Read_No_Breakdown
+
+
+def deliveries():
+    return pl.DataFrame({
+        'point_of_delivery_specific_location': ['Mid-Columbia (Mid-C)', 'MID-COLUMBIA (MID-C)', 'cob', 'COB', 'Palo Verde', 'COB', 'COB'],
+        'point_of_delivery_balancing_authority': ['HUB', 'hub', 'HUB', 'HUB', 'HUB', 'BPAT', 'HUB'],
+        'product_name': ['ENERGY', 'Energy', 'energy', 'ENERGY', 'ENERGY', 'ENERGY', 'Capacity']
+    }).cast({column: EQR_Format.DATATYPES[column] for column in EQR_Filter.RULE_COLUMNS.values()})
+
+
+# Product filters ignore case for every Granularity, the no_breakdown Script used to match 'Mid-Columbia (Mid-C)', 'HUB' and 'ENERGY' exactly
+def test_filters_ignore_case():
+    with pl.StringCache():
+        df = deliveries().with_row_index('row')
+        assert EQR_Filter.filter_energy(df)['row'].to_list() == [0, 1, 2, 3]
+        assert EQR_Filter.filter_ancillary(df)['row'].to_list() == [6]
+        exact = df.filter(pl.col('point_of_delivery_specific_location').cast(pl.Utf8).is_in(['Mid-Columbia (Mid-C)', 'COB']) &
+                          (pl.col('point_of_delivery_balancing_authority').cast(pl.Utf8) == 'HUB') & (pl.col('product_name').cast(pl.Utf8) == 'ENERGY'))
+        assert exact['row'].to_list() == [0, 3]
+        assert EQR_Filter.route(df, EQR_Filter.PRODUCTS)['energy']['row'].to_list() == [0, 1, 2, 3]
+
+
+def test_scripts_share_the_filters():
+    for script in [EQR_Read_No_Breakdown, EQR_Read_Daily, EQR_Read_Hourly]:
+        assert not hasattr(script, 'filter_energy') and not hasattr(script, 'filter_ancillary')
+        assert script.EQR_Filter is EQR_Filter
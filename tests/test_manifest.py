@@ -0,0 +1,57 @@
+import io
+import os
+import zipfile
+import polars as pl
+import pytest
+import EQR_CLI
+import EQR_Paths
+import EQR_Pipeline
+import EQR_Synthetic
+
+GRANULARITIES = ['no_breakdown', 'hourly']
+
+
+# Data, temp and output roots of the test, the environment is restored afterwards
+@pytest.fixture
+def roots(tmp_path, monkeypatch):
+    for name, variable in EQR_Paths.ENVIRONMENT.items():
+        monkeypatch.setenv(variable, str(tmp_path / name.lower()))
+        monkeypatch.setattr(EQR_Paths, name, str(tmp_path / name.lower()))
+    return tmp_path
+
+
+# Replace one Company ZIP of the outer ZIP with its refiling, the other members keep their bytes and CRC
+def refile(outer_file, member, refiled_file):
+    with zipfile.ZipFile(outer_file) as zf_outer, zipfile.ZipFile(refiled_file) as zf_refiled:
+        members = [(name, zf_refiled.read(name) if name == member else zf_outer.read(name)) for name in zf_outer.namelist()]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf_outer:
+        for name, data in members:
+            zf_outer.writestr(name, data)
+    with open(outer_file, 'wb') as file:
+        file.write(buffer.getvalue())
+
+
+def read_outputs(year_quarter):
+    return {granularity: pl.read_parquet(EQR_Pipeline.output_path('energy', granularity, year_quarter)) for granularity in GRANULARITIES}
+
+
+# An incremental run on a fresh output root, then after one Company refiled, gives the same Files as a full rebuild
+def test_incremental_matches_full_rebuild(roots):
+    outer_file, _ = EQR_Synthetic.make_quarter(EQR_Paths.DATA_DIRECTORY, '2024_Q1', companies=4, rows_per_company=500, seed=0)
+    refiled_file, _ = EQR_Synthetic.make_quarter(str(roots / 'refiled'), '2024_Q1', companies=4, rows_per_company=500, seed=1)
+    incremental = ['incremental', '2024_Q1', '--products', 'energy', '--granularities'] + GRANULARITIES
+
+    EQR_CLI.main(incremental)
+    first = read_outputs('2024_Q1')
+    EQR_Pipeline.main('2024_Q1', products=('energy',), granularities=GRANULARITIES)
+    for granularity, df in read_outputs('2024_Q1').items():
+        assert first[granularity].equals(df)
+
+    refile(outer_file, 'C000001_2024_Q1.zip', refiled_file)
+    EQR_CLI.main(incremental)
+    updated = read_outputs('2024_Q1')
+    EQR_Pipeline.main('2024_Q1', products=('energy',), granularities=GRANULARITIES)
+    for granularity, df in read_outputs('2024_Q1').items():
+        assert not first[granularity].equals(df)
+        assert updated[granularity].equals(df)
@@ -0,0 +1,80 @@
+import io
+import polars as pl
+import pytest
+import EQR_Filter
+import EQR_Format
+import EQR_Reader
+import EQR_Synthetic
+
+
+# transactions.csv as filed: ISO-8859-1, some quoted Fields with Newlines and quotes, optionally CRLF line ends
+def transactions_csv(rows=300, crlf=False):
+    df = EQR_Synthetic.make_transactions(rows, '2024_Q1', seed=7, company='Énergie Québec Inc')
+    df = df.with_columns(pl.when(pl.int_range(pl.len()) % 7 == 3)
+                         .then(pl.lit('Customer "North"\nWest Division'))
+                         .otherwise(pl.col('customer_company_name'))
+                         .alias('customer_company_name'))
+    data = df.write_csv(null_value='').encode('ISO-8859-1')
+    return data.replace(b'\n', b'\r\n') if crlf else data
+
+
+def read_whole(data, filter_function):
+    return filter_function(pl.read_csv(data.decode('ISO-8859-1').encode('utf8'), schema=EQR_Format.DATATYPES, null_values=''))
+
+
+def keep_all(df):
+    return df
+
+
+# Blocks always end on a Record, whatever the block size, so the rows read block by block equal a whole-file read
+@pytest.mark.parametrize('crlf', [False, True])
+@pytest.mark.parametrize('chunk_size', [97, 1000, 4096, EQR_Reader.CHUNK_SIZE])
+def test_blocks_match_whole_file(crlf, chunk_size):
+    data = transactions_csv(crlf=crlf)
+    blocks = list(EQR_Reader.csv_chunks(io.BytesIO(data), chunk_size))
+    assert b''.join(blocks) == data
+    assert all(block.count(b'"') % 2 == 0 and block.endswith(b'\n') for block in blocks)
+    if chunk_size < len(data):
+        assert len(blocks) > 1
+    with pl.StringCache():
+        df = EQR_Reader.read_transactions(io.BytesIO(data), EQR_Format.DATATYPES, keep_all, chunk_size)
+        assert df.equals(read_whole(data, keep_all))
+    assert df['seller_company_name'][0] == 'Énergie Québec Inc'
+    assert df['customer_company_name'][3].replace('\r', '') == 'Customer "North"\nWest Division'
+
+
+# A Record longer than the block size is carried over until a block ends after it, and a File without a final Newline keeps its last Record
+def test_record_straddling_blocks():
+    data = transactions_csv(rows=5)
+    blocks = list(EQR_Reader.csv_chunks(io.BytesIO(data[:-1]), 16))
+    assert b''.join(blocks) == data[:-1]
+    assert len(blocks) == 6
+
+
+# Two-pass parse: filter columns first, then only the matching Records. Blocks with quoted Newlines, blocks where every row
+# or no row matches fall back or return early, all give the rows of a whole-file read
+@pytest.mark.parametrize('crlf', [False, True])
+@pytest.mark.parametrize('chunk_size', [97, 2000, EQR_Reader.CHUNK_SIZE])
+@pytest.mark.parametrize('filter_function', [EQR_Filter.filter_energy, EQR_Filter.filter_ancillary, keep_all])
+def test_filtered_blocks_match_whole_file(crlf, chunk_size, filter_function):
+    data = transactions_csv(crlf=crlf)
+    with pl.StringCache():
+        df = EQR_Reader.read_transactions(io.BytesIO(data), EQR_Format.DATATYPES, filter_function, chunk_size)
+        expected = read_whole(data, filter_function)
+        assert df.equals(expected)
+    assert 0 < df.height
+
+
+# Only the matching Records of a block without quoted Newlines are parsed with every column
+def test_read_block_parses_matching_records(monkeypatch):
+    data = EQR_Synthetic.make_transactions(200, '2024_Q1', seed=3).write_csv(null_value='').encode('utf8')
+    parsed = []
+    read_csv = pl.read_csv
+    monkeypatch.setattr(pl, 'read_csv', lambda source, **kwargs: parsed.append((len(source), kwargs.get('columns'))) or read_csv(source, **kwargs))
+    with pl.StringCache():
+        df = EQR_Reader.read_block(data, True, EQR_Format.DATATYPES, EQR_Filter.filter_energy)
+        monkeypatch.undo()
+        assert df.equals(read_whole(data, EQR_Filter.filter_energy))
+    assert 0 < df.height < 200
+    assert [columns is None for size, columns in parsed] == [False, True]
+    assert parsed[1][0] < len(data) / 2
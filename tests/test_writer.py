@@ -0,0 +1,150 @@
+import os
+import polars as pl
+import pytest
+import EQR_Format
+import EQR_Synthetic
+import EQR_Writer
+
+QUARTERS = ['2023_Q4', '2024_Q1', '2024_Q2']
+
+
+# Per-Quarter Files as the Pipeline writes them: spill Files merged into the Parquet File, then its CSV twin
+def write_quarter(directory, year_quarter, rows, seed, twin=True):
+    path = os.path.join(directory, f'intermediate_energy_transactions_daily_{year_quarter}.parquet')
+    df = EQR_Format.fix_data_format(EQR_Synthetic.make_transactions(rows, year_quarter, seed=seed))
+    spills = [os.path.join(directory, f'spill_{year_quarter}_{i}.parquet') for i in range(2)]
+    EQR_Writer.write_spill(df.head(rows // 2), spills[0])
+    EQR_Writer.write_spill(df.slice(rows // 2), spills[1])
+    EQR_Writer.merge_spill(spills, path)
+    if twin:
+        EQR_Writer.write_twin(spills, path)
+    for spill in spills:
+        os.remove(spill)
+    return path
+
+
+@pytest.fixture
+def quarters(tmp_path):
+    directory = tmp_path / 'energy_daily'
+    directory.mkdir()
+    return [write_quarter(str(directory), year_quarter, 200 + 50 * i, i) for i, year_quarter in enumerate(QUARTERS)]
+
+
+# Concatenation by conversion of every Quarter, the reference of the other ways
+def converted(tmp_path, paths):
+    output = str(tmp_path / 'converted.csv')
+    EQR_Writer.convert_csv([(year_quarter, path) for year_quarter, path in zip(QUARTERS, paths)], output, workers=2)
+    with open(output, 'rb') as file:
+        return file.read()
+
+
+# Twins are checked from their index and the Parquet footer alone, a changed Parquet File or twin is converted again
+def test_twins_are_current_without_parsing(tmp_path, quarters, monkeypatch):
+    expected = converted(tmp_path, quarters)
+    for function in ['read_csv', 'scan_csv']:
+        monkeypatch.setattr(pl, function, lambda *args, **kwargs: pytest.fail('a twin was parsed'))
+    assert all(EQR_Writer.twin_is_current(path) for path in quarters)
+    output = str(tmp_path / 'appended.csv')
+    EQR_Writer.concat_csv(os.path.dirname(quarters[0]), output, resume=False)
+    assert EQR_Writer.read_index(output)['format'] == 'csv_append'
+    with open(output, 'rb') as file:
+        assert file.read() == expected
+    monkeypatch.undo()
+
+    # Rewritten Parquet File without its twin, then a twin edited by hand: both Quarters are converted, the third one is copied
+    write_quarter(os.path.dirname(quarters[1]), QUARTERS[1], 300, 5, twin=False)
+    with open(EQR_Writer.csv_twin(quarters[2]), 'ab') as file:
+        file.write(b'extra row\n')
+    assert [EQR_Writer.twin_is_current(path) for path in quarters] == [True, False, False]
+    expected = converted(tmp_path, quarters)
+    EQR_Writer.concat_csv(os.path.dirname(quarters[0]), output, resume=False)
+    assert EQR_Writer.read_index(output)['format'] == 'csv'
+    with open(output, 'rb') as file:
+        assert file.read() == expected
+
+    EQR_Writer.remove_twin(quarters[0])
+    assert not os.path.exists(EQR_Writer.csv_twin(quarters[0]))
+    assert not os.path.exists(EQR_Writer.index_path(EQR_Writer.csv_twin(quarters[0])))
+
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+# Cut the output in the middle of the second Quarter, as a crash during its write would
+def truncate_mid_second_quarter(output, expected_quarters):
+    end = expected_quarters[1]['offset'] + expected_quarters[1]['bytes'] // 2
+    with open(output, 'r+b') as file:
+        file.truncate(end)
+
+
+# A conversion interrupted after writing the second Quarter but before indexing it resumes after the first one, byte for byte
+def test_convert_resumes_after_interruption(tmp_path, quarters, monkeypatch, capsys):
+    for path in quarters:
+        EQR_Writer.remove_twin(path)
+    expected = converted(tmp_path, quarters)
+    expected_quarters = EQR_Writer.read_index(str(tmp_path / 'converted.csv'))['quarters']
+    output = str(tmp_path / 'final.csv')
+    write_index = EQR_Writer.write_index
+    calls = []
+
+    def interrupted_write_index(path, index):
+        calls.append(path)
+        if len(calls) == 3:  # the index after the first Quarter is the last one written
+            raise KeyboardInterrupt
+        write_index(path, index)
+
+    monkeypatch.setattr(EQR_Writer, 'write_index', interrupted_write_index)
+    with pytest.raises(KeyboardInterrupt):
+        EQR_Writer.concat_csv(os.path.dirname(quarters[0]), output, workers=2)
+    monkeypatch.undo()
+    truncate_mid_second_quarter(output, expected_quarters)
+    assert not EQR_Writer.read_index(output)['complete']
+
+    EQR_Writer.concat_csv(os.path.dirname(quarters[0]), output, workers=2)
+    assert 'after 1 Quarters' in capsys.readouterr().out
+    assert read_bytes(output) == expected
+    assert EQR_Writer.read_index(output) == dict(EQR_Writer.read_index(str(tmp_path / 'converted.csv')), complete=True)
+
+
+# Appending twins interrupted in the middle of the second Quarter copies it again on resume, byte for byte
+def test_append_resumes_after_interruption(tmp_path, quarters, monkeypatch, capsys):
+    expected = converted(tmp_path, quarters)
+    expected_quarters = EQR_Writer.read_index(str(tmp_path / 'converted.csv'))['quarters']
+    output = str(tmp_path / 'final.csv')
+    copy_region = EQR_Writer.copy_region
+
+    def interrupted_copy_region(output_file_path, region):
+        if region[0] == EQR_Writer.csv_twin(quarters[1]):
+            raise KeyboardInterrupt
+        copy_region(output_file_path, region)
+
+    monkeypatch.setattr(EQR_Writer, 'copy_region', interrupted_copy_region)
+    with pytest.raises(KeyboardInterrupt):
+        EQR_Writer.concat_csv(os.path.dirname(quarters[0]), output, workers=1)
+    monkeypatch.undo()
+    with open(output, 'r+b') as file:
+        file.seek(expected_quarters[1]['offset'])
+        file.write(b'partial copy')
+    assert [quarter['done'] for quarter in EQR_Writer.read_index(output)['quarters']][:2] == [True, False]
+
+    EQR_Writer.concat_csv(os.path.dirname(quarters[0]), output, workers=1)
+    assert 'Resume' in capsys.readouterr().out
+    assert read_bytes(output) == expected
+
+
+# An output whose header differs from the one to write, even with the same length, is written again from the start
+@pytest.mark.parametrize('twins', [True, False])
+def test_resume_checks_header_bytes(tmp_path, quarters, twins):
+    if not twins:
+        for path in quarters:
+            EQR_Writer.remove_twin(path)
+    expected = converted(tmp_path, quarters)
+    output = str(tmp_path / 'final.csv')
+    EQR_Writer.concat_csv(os.path.dirname(quarters[0]), output)
+    with open(output, 'r+b') as file:
+        file.write(read_bytes(output)[:20].upper())
+    assert read_bytes(output) != expected
+    EQR_Writer.concat_csv(os.path.dirname(quarters[0]), output)
+    assert read_bytes(output) == expected